@@ -1,14 +1,46 @@
 from datetime import datetime, timedelta
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
 import requests
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# access tokens live for 30 days; renew one day before they expire
+REFRESH_AHEAD = 24 * 3600
+REFRESH_RETRY = 60
+
 class Auth(object):
-    def __init__(self, endpoint: str="http://openapi.baidu.com/oauth/2.0", key: str="", secret: str=""):
+    def __init__(self, endpoint: str="http://openapi.baidu.com/oauth/2.0", key: str="", secret: str="", token_file: str=".access_token"):
         self.endpoint:str = endpoint
         self.key:str = key
         self.secret:str = secret
         self.access_token:dict = {}
         self.refresh_at:float = 0.0
         self.refresh_token_file = ".refresh_token"
+        # shared by every process on the host that syncs with this app key
+        self.token_file = token_file
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._refresher = None
+        # the sync.metrics.Metrics of every Sync running with this Auth;
+        # daemon mode runs several at once, each on its own thread
+        self._observers = []
+        self._observers_lock = threading.Lock()
+
+    def add_observer(self, observer) -> None:
+        with self._observers_lock:
+            self._observers.append(observer)
+
+    def remove_observer(self, observer) -> None:
+        with self._observers_lock:
+            self._observers.remove(observer)
 
     def headers(self) -> dict:
         return {'User-Agent': 'pan.baidu.com'}
@@ -18,20 +50,29 @@ class Auth(object):
         refresh_at = datetime.now() + timedelta(seconds=access_token['expires_in'])
         self.refresh_at = refresh_at.timestamp()
         self._dump_refresh_token(access_token['refresh_token'])
+        self._dump_access_token()
 
     def authorize_url(self) -> str:
         return f'{self.endpoint}/authorize?response_type=code&client_id={self.key}&redirect_uri=oob&scope=basic,netdisk'
-    
+
     def setup_access_token(self, code: str) -> None:
         url = f'{self.endpoint}/token?grant_type=authorization_code&code={code}&client_id={self.key}&client_secret={self.secret}&redirect_uri=oob'
         resp = requests.get(url, headers=self.headers())
         if resp.status_code == 200:
-            return self._set_access_token(resp.json())
+            with self._lock, self._token_file_lock():
+                return self._set_access_token(resp.json())
         raise Exception(f'setup_access_token failed, response: {resp.text}')
 
     def refresh_access_token(self, refresh_token: str) -> None:
         url = f'{self.endpoint}/token?grant_type=refresh_token&refresh_token={refresh_token}&client_id={self.key}&client_secret={self.secret}'
+        start = time.perf_counter()
         resp = requests.get(url, headers=self.headers())
+        elapsed = time.perf_counter() - start
+        with self._observers_lock:
+            observers = list(self._observers)
+        for observer in observers:
+            observer.observe('phase_seconds', elapsed, phase='token_refresh')
+            observer.inc('token_refreshes', status=str(resp.status_code))
         if resp.status_code == 200:
             return self._set_access_token(resp.json())
         raise Exception(f'refresh_access_token failed, response: {resp.text}')
@@ -39,10 +80,81 @@ class Auth(object):
     def get_access_token(self) -> str:
         if self.refresh_at == 0.0:
             raise Exception('access_token not set')
+        # only an already expired token makes the caller wait; renewing ahead
+        # of expiry is left to the refresher thread
         if datetime.now().timestamp() >= self.refresh_at:
-            self.refresh_access_token(self.access_token['refresh_token'])
+            self.renew_access_token()
         return self.access_token['access_token']
 
+    def refresh_due(self) -> float:
+        ahead = min(REFRESH_AHEAD, self.access_token.get('expires_in', 0) / 10)
+        return self.refresh_at - ahead
+
+    def renew_access_token(self) -> None:
+        # the thread lock keeps workers of this process from refreshing at
+        # once, the file lock does the same for other processes; whoever
+        # comes second adopts the token the first one stored
+        with self._lock, self._token_file_lock():
+            cached = self._load_access_token()
+            if cached and cached['refresh_at'] > self.refresh_at:
+                self.access_token = cached['access_token']
+                self.refresh_at = cached['refresh_at']
+            if datetime.now().timestamp() < self.refresh_due():
+                return
+            logging.info('refreshing access_token')
+            self.refresh_access_token(self.access_token['refresh_token'])
+
+    def start_refresher(self) -> None:
+        if self._refresher is not None:
+            return
+        self._stop.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name='token-refresher', daemon=True)
+        self._refresher.start()
+
+    def stop_refresher(self) -> None:
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            wait = self.refresh_due() - datetime.now().timestamp()
+            if wait > 0:
+                self._stop.wait(min(wait, 3600))
+                continue
+            try:
+                self.renew_access_token()
+            except Exception as e:
+                logging.error(f'background refresh of access_token failed: {e}')
+                self._stop.wait(REFRESH_RETRY)
+
+    @contextmanager
+    def _token_file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.token_file + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_access_token(self) -> dict:
+        try:
+            with open(self.token_file, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _dump_access_token(self):
+        tmp = f'{self.token_file}.{os.getpid()}.tmp'
+        with open(tmp, "w") as f:
+            json.dump({'access_token': self.access_token, 'refresh_at': self.refresh_at}, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.token_file)
+
     def _dump_refresh_token(self, refresh_token:str):
         if len(refresh_token) == 0:
             return
@@ -51,10 +163,15 @@ class Auth(object):
 
     def try_recover_access_token(self) -> bool:
         try:
-            with open(self.refresh_token_file, "r") as f:
-                refresh_token = f.read()
-                self.refresh_access_token(refresh_token.strip())
-                return True
+            with self._lock, self._token_file_lock():
+                cached = self._load_access_token()
+                if cached and time.time() < cached['refresh_at']:
+                    self.access_token = cached['access_token']
+                    self.refresh_at = cached['refresh_at']
+                    return True
+                with open(self.refresh_token_file, "r") as f:
+                    refresh_token = f.read()
+                    self.refresh_access_token(refresh_token.strip())
+                    return True
         except Exception:
             return False
-
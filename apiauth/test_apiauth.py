@@ -1,6 +1,19 @@
+import os
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 from apiauth import apiauth
 
+class FakeResponse(object):
+    def __init__(self, token):
+        self.status_code = 200
+        self.token = token
+
+    def json(self):
+        return self.token
+
 class ApiAuthTest(unittest.TestCase):
     def setUp(self):
         self.key = "key"
@@ -12,5 +25,75 @@ class ApiAuthTest(unittest.TestCase):
         print(url)
         self.assertEqual(url, f"http://openapi.baidu.com/oauth/2.0/authorize?response_type=code&client_id={self.key}&redirect_uri=oob&scope=basic,netdisk")
 
+class TokenRefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.dir.name)
+        self.refreshes = 0
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+
+    def fake_get(self, url, headers=None):
+        time.sleep(0.05)
+        self.refreshes += 1
+        n = self.refreshes
+        return FakeResponse({'access_token': f'at{n}', 'refresh_token': f'rt{n}', 'expires_in': 1000})
+
+    def new_auth(self):
+        auth = apiauth.Auth(key="key", secret="secret", token_file=os.path.join(self.dir.name, 'token'))
+        auth.access_token = {'access_token': 'at0', 'refresh_token': 'rt0', 'expires_in': 1000}
+        auth.refresh_at = time.time() - 1
+        return auth
+
+    def test_expired_token_is_refreshed_once(self):
+        auth = self.new_auth()
+        tokens = []
+        with mock.patch.object(apiauth.requests, 'get', side_effect=self.fake_get):
+            threads = [threading.Thread(target=lambda: tokens.append(auth.get_access_token())) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(self.refreshes, 1)
+        self.assertEqual(tokens, ['at1'] * 8)
+
+    def test_token_is_shared_through_cache_file(self):
+        first, second = self.new_auth(), self.new_auth()
+        with mock.patch.object(apiauth.requests, 'get', side_effect=self.fake_get):
+            self.assertEqual(first.get_access_token(), 'at1')
+            self.assertEqual(second.get_access_token(), 'at1')
+            third = apiauth.Auth(key="key", secret="secret", token_file=os.path.join(self.dir.name, 'token'))
+            self.assertTrue(third.try_recover_access_token())
+            self.assertEqual(third.get_access_token(), 'at1')
+        self.assertEqual(self.refreshes, 1)
+
+    def test_refresh_is_recorded_by_every_running_sync(self):
+        auth = self.new_auth()
+        first, second = mock.Mock(), mock.Mock()
+        auth.add_observer(first)
+        auth.add_observer(second)
+        # one sync finishing must not stop the other from recording
+        auth.remove_observer(first)
+        with mock.patch.object(apiauth.requests, 'get', side_effect=self.fake_get):
+            auth.get_access_token()
+        first.inc.assert_not_called()
+        second.inc.assert_called_once_with('token_refreshes', status='200')
+        self.assertEqual(second.observe.call_args.kwargs, {'phase': 'token_refresh'})
+
+    def test_refresher_renews_ahead_of_expiry(self):
+        auth = self.new_auth()
+        auth.refresh_at = time.time() + 50
+        with mock.patch.object(apiauth.requests, 'get', side_effect=self.fake_get):
+            auth.start_refresher()
+            for _ in range(100):
+                if self.refreshes:
+                    break
+                time.sleep(0.02)
+            auth.stop_refresher()
+        self.assertEqual(auth.get_access_token(), 'at1')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,176 @@
+import argparse
+import filecmp
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'third_party', 'pcssdk'))
+from apiauth import apiauth
+from bench import mockpcs
+from config.config import SyncType
+from openapi_client.configuration import Configuration
+from sync import sync
+
+REMOTE = '/apps/bench'
+
+
+def make_small(root: str, scale: float):
+    # many small files spread over a flat set of dirs
+    for d in range(20):
+        os.makedirs(os.path.join(root, f'dir{d}'))
+        for i in range(int(100 * scale)):
+            with open(os.path.join(root, f'dir{d}', f'file{i}.txt'), 'wb') as f:
+                f.write(os.urandom(4096))
+
+
+def make_huge(root: str, scale: float):
+    os.makedirs(root)
+    for i in range(3):
+        with open(os.path.join(root, f'huge{i}.bin'), 'wb') as f:
+            for _ in range(int(64 * scale)):
+                f.write(os.urandom(1024 * 1024))
+
+
+def make_deep(root: str, scale: float):
+    path = root
+    for depth in range(int(30 * scale)):
+        path = os.path.join(path, f'level{depth}')
+        os.makedirs(path)
+        for i in range(5):
+            with open(os.path.join(path, f'file{i}.dat'), 'wb') as f:
+                f.write(os.urandom(16 * 1024))
+
+
+SCENARIOS = {'small': make_small, 'huge': make_huge, 'deep': make_deep}
+
+
+def tree_size(root: str):
+    files, size = 0, 0
+    for parent, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(parent, name))
+    return files, size
+
+
+def same_tree(a: str, b: str) -> bool:
+    for parent, _, names in os.walk(a):
+        rel = os.path.relpath(parent, a)
+        for name in names:
+            if not filecmp.cmp(os.path.join(parent, name), os.path.join(b, rel, name), shallow=False):
+                return False
+    return True
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on linux; the mock shares the process but streams
+    # file data to and from disk, a chunk per connection at a time
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_phase(pcs: mockpcs.MockPCS, name: str, s: sync.Sync, files: int, size: int) -> dict:
+    pcs.reset_counts()
+    error = None
+    start = time.perf_counter()
+    try:
+        s.sync()
+    except sync.SyncException as e:
+        error = str(e)
+    elapsed = time.perf_counter() - start
+    s.index.close()
+    stats = pcs.stats()
+    return {'phase': name, 'seconds': round(elapsed, 3), 'files': files, 'bytes': size,
+            'files_per_s': round(files / elapsed, 1), 'mb_per_s': round(size / elapsed / 1024 / 1024, 2),
+            'requests': stats['requests'], 'request_total': sum(stats['requests'].values()),
+            'bytes_in': stats['bytes_in'], 'bytes_out': stats['bytes_out'],
+            'peak_rss_mb': round(peak_rss_mb(), 1), 'error': error, 'metrics': s.metrics.summary()}
+
+
+def run_scenario(name: str, args) -> list:
+    work = tempfile.mkdtemp(prefix=f'bench-{name}-')
+    src, dst, state = os.path.join(work, 'src'), os.path.join(work, 'dst'), os.path.join(work, 'state')
+    os.makedirs(dst)
+    os.makedirs(state)
+    SCENARIOS[name](src, args.scale)
+    files, size = tree_size(src)
+    pcs = mockpcs.MockPCS(latency=args.latency / 1000, bandwidth=int(args.bandwidth * 1024 * 1024),
+                          error_rate=args.error_rate, throttle_rate=args.throttle_rate, seed=1).start()
+    try:
+        pcs.mkdir(REMOTE)
+        auth = apiauth.Auth(endpoint=f'{pcs.url}/oauth/2.0', token_file=os.path.join(state, '.access_token'))
+        auth.refresh_token_file = os.path.join(state, '.refresh_token')
+        auth.setup_access_token('bench')
+        configuration = Configuration(host=pcs.url)
+        configuration.rate_limit = args.rate_limit
+        configuration.adaptive_concurrency = not args.no_adaptive
+
+        def new_sync(local: str, type: SyncType, index_file: str) -> sync.Sync:
+            return sync.Sync(local, REMOTE, auth, type, blocksize=args.blocksize * 1024 * 1024,
+                             concurrency=args.concurrency, block_concurrency=args.block_concurrency,
+                             journal_dir=os.path.join(state, 'journal'),
+                             index_file=os.path.join(state, index_file), configuration=configuration)
+
+        results = [run_phase(pcs, 'upload', new_sync(src, SyncType.UPLOAD, 'up.db'), files, size),
+                   run_phase(pcs, 'upload again', new_sync(src, SyncType.UPLOAD, 'up.db'), 0, 0),
+                   run_phase(pcs, 'download', new_sync(dst, SyncType.DOWNLOAD, 'down.db'), files, size)]
+        if args.verify and not same_tree(src, dst):
+            results[-1]['error'] = results[-1]['error'] or 'downloaded tree differs from source'
+        for r in results:
+            r['scenario'] = name
+        return results
+    finally:
+        pcs.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def report(results: list):
+    print(f"{'scenario':<8} {'phase':<13} {'files':>6} {'MB':>8} {'sec':>8} {'files/s':>9} {'MB/s':>8} "
+          f"{'reqs':>6} {'rss MB':>7}  requests")
+    for r in results:
+        print(f"{r['scenario']:<8} {r['phase']:<13} {r['files']:>6} {r['bytes'] / 1024 / 1024:>8.1f} "
+              f"{r['seconds']:>8.3f} {r['files_per_s']:>9.1f} {r['mb_per_s']:>8.2f} {r['request_total']:>6} "
+              f"{r['peak_rss_mb']:>7.1f}  {' '.join(f'{k}={v}' for k, v in sorted(r['requests'].items()))}")
+        if r['error']:
+            print(f"{'':<8} {'':<13} error: {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='end to end sync benchmark against an in-process mock pcs')
+    parser.add_argument('scenarios', nargs='*', help=f"any of {', '.join(SCENARIOS)}, all by default")
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies file counts and sizes')
+    parser.add_argument('--latency', type=float, default=0.0, help='added to every request, in ms')
+    parser.add_argument('--bandwidth', type=float, default=0.0, help='MB/s shared by all transfers, 0 for unlimited')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with errno 31034')
+    parser.add_argument('--blocksize', type=int, default=4, help='upload block size in MB')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--block-concurrency', type=int, default=4)
+    parser.add_argument('--rate-limit', type=float, default=0, help='client side requests/s, 0 for unlimited')
+    parser.add_argument('--no-adaptive', action='store_true', help='disable the adaptive in-flight limit')
+    parser.add_argument('--verify', action='store_true', help='compare the downloaded tree with the source')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario {name}')
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        results += run_scenario(name, args)
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    # python -m bench.bench [small|huge|deep ...] [--latency MS] [--bandwidth MB/s] ...
+    main()
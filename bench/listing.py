@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'third_party', 'pcssdk'))
+from openapi_client import api_client
+from openapi_client.api import fileinfo_api
+
+ENTRIES = 10000
+ROUNDS = 5
+
+
+class FakeResponse(object):
+    def __init__(self, data: bytes):
+        self.data = data
+        self.status = 200
+
+    def getheader(self, name, default=None):
+        return 'application/json; charset=UTF-8' if name.lower() == 'content-type' else default
+
+    def getheaders(self):
+        return {'Content-Type': 'application/json; charset=UTF-8'}
+
+
+def listing(entries: int) -> bytes:
+    files = []
+    for i in range(entries):
+        files.append({
+            'fs_id': 100000000 + i, 'path': f'/apps/bench/dir/file{i}.dat', 'server_filename': f'file{i}.dat',
+            'size': i * 1024, 'server_mtime': 1650000000 + i, 'server_ctime': 1650000000, 'local_mtime': 1650000000,
+            'local_ctime': 1650000000, 'isdir': 0, 'category': 6, 'md5': f'{i:032x}', 'privacy': 0,
+            'unlist': 0, 'oper_id': 0, 'share': 0, 'thumbs': {'url1': f'https://thumb/{i}'},
+        })
+    return json.dumps({'errno': 0, 'guid_info': '', 'list': files, 'request_id': 1, 'guid': 0}).encode()
+
+
+def run(name: str, client: api_client.ApiClient, body: bytes):
+    # xpanfilelist end to end with the http round trip replaced by a canned
+    # response, so only client side parsing and validation is measured
+    client.request = lambda *args, **kwargs: FakeResponse(body)
+    api = fileinfo_api.FileinfoApi(client)
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        ret = api.xpanfilelist('token', dir='/apps/bench/dir', start='0', limit=ENTRIES)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert len(ret['list']) == ENTRIES
+    print(f'{name:>24}: {best * 1000:.1f} ms, {ENTRIES / best:.0f} entries/s, {len(body) / best / 1024 / 1024:.1f} MB/s')
+
+
+if __name__ == '__main__':
+    body = listing(ENTRIES)
+    run('deserialize', api_client.ApiClient(), body)
+    run('fast_deserialize', api_client.ApiClient(fast_deserialize=True), body)
+    if api_client.orjson is not None:
+        api_client.orjson = None
+        run('fast_deserialize (json)', api_client.ApiClient(fast_deserialize=True), body)
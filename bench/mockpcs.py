@@ -0,0 +1,408 @@
+import collections
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+# transfers are throttled in chunks of this size so that concurrent
+# connections interleave instead of taking turns
+THROTTLE_CHUNK = 64 * 1024
+# errno pcs answers with when an app calls it too often
+ERRNO_THROTTLED = 31034
+
+
+class Throttle(object):
+    """Shared bandwidth limit: every transfer reserves its slot on one
+    virtual clock, so the limit holds across all connections."""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next = 0.0
+
+    def consume(self, n: int):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + n / self.rate
+            wait = self.next - now
+        time.sleep(wait)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients dropping connections they no longer need is not an error
+        if not issubclass(sys.exc_info()[0], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockPCS(object):
+    """In-process stand-in for the pcs endpoints Sync and Auth use.
+
+    Files are kept under a temp dir keyed by fs_id and uploaded blocks are
+    streamed to it, so the mock holds no more than a chunk per connection
+    and memory use of the process is the client's. latency is
+    added to every request, bandwidth (bytes/s, 0 for unlimited) is shared
+    by uploads and downloads, error_rate answers with a 500 and
+    throttle_rate with errno 31034.
+    """
+
+    def __init__(self, latency: float = 0.0, bandwidth: int = 0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.throttle = Throttle(bandwidth)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.fs_ids = itertools.count(1000)
+        self.files: Dict[str, Dict] = {'/': self._entry('/', 1)}
+        self.sessions: Dict[str, Dict] = {}
+        self.storage = None
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockPCS':
+        self.storage = tempfile.mkdtemp(prefix='mockpcs-')
+        handler = type('Handler', (MockHandler,), {'pcs': self})
+        self.server = MockServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mockpcs', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.storage is not None:
+            shutil.rmtree(self.storage, ignore_errors=True)
+            self.storage = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counts(self):
+        with self.lock:
+            self.counts.clear()
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'requests': dict(self.counts), 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
+
+    def _entry(self, path: str, isdir: int, size: int = 0, md5: str = '') -> Dict:
+        name = os.path.basename(path)
+        return {'fs_id': next(self.fs_ids), 'path': path, 'server_filename': name, 'size': size,
+                'server_mtime': int(time.time()), 'isdir': isdir, 'md5': md5, 'category': 6}
+
+    def blob(self, fs_id: int) -> str:
+        return os.path.join(self.storage, str(fs_id))
+
+    def mkdir(self, path: str) -> Dict:
+        with self.lock:
+            return self._mkdir(path)
+
+    def _mkdir(self, path: str) -> Dict:
+        path = path.rstrip('/') or '/'
+        if path not in self.files:
+            self._mkdir(os.path.dirname(path))
+            self.files[path] = self._entry(path, 1)
+        return self.files[path]
+
+    def _put(self, path: str, size: int, md5: str) -> Dict:
+        self._mkdir(os.path.dirname(path))
+        old = self.files.get(path)
+        entry = self._entry(path, 0, size, md5)
+        self.files[path] = entry
+        if old is not None and not old['isdir']:
+            os.unlink(self.blob(old['fs_id']))
+        return entry
+
+    def children(self, path: str, recursive: bool):
+        path = path.rstrip('/') or '/'
+        prefix = path if path == '/' else path + '/'
+        with self.lock:
+            ret = [e for p, e in self.files.items() if p.startswith(prefix) and p != '/'
+                   and (recursive or '/' not in p[len(prefix):])]
+        return sorted(ret, key=lambda e: e['path'])
+
+    # endpoint handlers, each returns a json-serializable dict
+
+    def xpan_file_list(self, q, form):
+        path = q.get('dir', '/')
+        if path.rstrip('/') not in self.files and path != '/':
+            return {'errno': -9, 'request_id': 0}
+        start, limit = int(q.get('start', 0)), int(q.get('limit', 1000))
+        return {'errno': 0, 'list': self.children(path, False)[start:start + limit], 'request_id': 0}
+
+    def xpan_multimedia_listall(self, q, form):
+        path = q.get('path', '/')
+        if path.rstrip('/') not in self.files and path != '/':
+            return {'errno': -9, 'request_id': 0}
+        start, limit = int(q.get('start', 0)), int(q.get('limit', 1000))
+        files = self.children(path, q.get('recursion') == '1')
+        page = files[start:start + limit]
+        return {'errno': 0, 'list': page, 'has_more': int(start + limit < len(files)),
+                'cursor': start + len(page), 'request_id': 0}
+
+    def xpan_file_precreate(self, q, form):
+        path, size = form['path'], int(form.get('size', 0))
+        block_list = json.loads(form.get('block_list', '[]'))
+        content_md5 = form.get('content-md5')
+        if content_md5:
+            with self.lock:
+                same = next((e for e in self.files.values() if not e['isdir']
+                             and e['md5'] == content_md5 and e['size'] == size), None)
+                if same is not None:
+                    entry = self._put(path, size, content_md5)
+                    shutil.copyfile(self.blob(same['fs_id']), self.blob(entry['fs_id']))
+                    return {'errno': 0, 'return_type': 2, 'request_id': 0,
+                            'info': dict(entry, mtime=entry['server_mtime'])}
+        uploadid = uuid.uuid4().hex
+        os.mkdir(os.path.join(self.storage, uploadid))
+        with self.lock:
+            self.sessions[uploadid] = {'path': path, 'parts': {}}
+        return {'errno': 0, 'return_type': 1, 'uploadid': uploadid,
+                'block_list': list(range(len(block_list))), 'request_id': 0}
+
+    def pcs_superfile2_upload(self, q, part: str):
+        # part is the uploaded block, already spooled to a file by the handler
+        session = self.sessions.get(q.get('uploadid', ''))
+        if session is None or session['path'] != q.get('path'):
+            return {'error_code': 31363, 'error_msg': 'block miss in superfile2', 'request_id': 0}
+        partseq = int(q.get('partseq', 0))
+        content = hashlib.md5()
+        with open(part, 'rb') as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                content.update(chunk)
+        os.replace(part, os.path.join(self.storage, q['uploadid'], str(partseq)))
+        md5 = content.hexdigest()
+        with self.lock:
+            session['parts'][partseq] = md5
+        return {'md5': md5, 'request_id': 0}
+
+    def xpan_file_create(self, q, form):
+        path = form['path']
+        if form.get('isdir') == '1':
+            return dict(self.mkdir(path), errno=0, request_id=0)
+        uploadid = form.get('uploadid', '')
+        block_list = json.loads(form.get('block_list', '[]'))
+        with self.lock:
+            session = self.sessions.pop(uploadid, None)
+        if session is None or any(session['parts'].get(i) != md5 for i, md5 in enumerate(block_list)):
+            return {'errno': 10, 'request_id': 0}
+        parts = os.path.join(self.storage, uploadid)
+        content = hashlib.md5()
+        tmp = os.path.join(self.storage, uploadid + '.data')
+        with open(tmp, 'wb') as out:
+            for i in range(len(block_list)):
+                with open(os.path.join(parts, str(i)), 'rb') as f:
+                    while True:
+                        chunk = f.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        content.update(chunk)
+                        out.write(chunk)
+        shutil.rmtree(parts)
+        with self.lock:
+            entry = self._put(path, os.path.getsize(tmp), content.hexdigest())
+            os.replace(tmp, self.blob(entry['fs_id']))
+        return dict(entry, errno=0, mtime=entry['server_mtime'], name=path, request_id=0)
+
+    def xpan_multimedia_filemetas(self, q, form, base: str):
+        fsids = set(json.loads(q.get('fsids', '[]')))
+        with self.lock:
+            found = [dict(e) for e in self.files.values() if e['fs_id'] in fsids]
+        for e in found:
+            e['filename'] = e['server_filename']
+            if q.get('dlink') == '1' and not e['isdir']:
+                e['dlink'] = f"{base}/file/{e['fs_id']}?fid={e['fs_id']}"
+        return {'errno': 0, 'list': found, 'request_id': 0}
+
+    def oauth_token(self, q, form):
+        if q.get('grant_type') not in ('authorization_code', 'refresh_token'):
+            return {'error': 'unsupported_grant_type'}
+        return {'access_token': uuid.uuid4().hex, 'refresh_token': uuid.uuid4().hex,
+                'expires_in': 2592000, 'scope': 'basic netdisk'}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; with Nagle and delayed
+    # acks every response would stall for ~40ms
+    disable_nagle_algorithm = True
+    pcs: MockPCS = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        pcs = self.pcs
+        url = urlsplit(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        endpoint = url.path.strip('/').replace('rest/2.0/', '').replace('/', '_')
+        if endpoint.startswith('file_'):
+            endpoint = 'file'
+        elif endpoint.endswith('_token'):
+            endpoint = 'oauth_token'
+        elif 'method' in q:
+            endpoint += '_' + q['method']
+        if endpoint == 'pcs_superfile2_upload':
+            part = os.path.join(pcs.storage, uuid.uuid4().hex + '.part')
+            with open(part, 'wb') as out:
+                self.multipart_file(out)
+            try:
+                return self.handle_endpoint(endpoint, url, q, part)
+            finally:
+                if os.path.exists(part):
+                    os.unlink(part)
+        self.handle_endpoint(endpoint, url, q, self.read_body())
+
+    def handle_endpoint(self, endpoint: str, url, q: Dict, body):
+        pcs = self.pcs
+        with pcs.lock:
+            pcs.counts[endpoint] += 1
+        if pcs.latency:
+            time.sleep(pcs.latency)
+        if pcs.error_rate and pcs.random.random() < pcs.error_rate:
+            return self.reply(500, b'{"error_code": 31024, "error_msg": "injected error"}')
+        if pcs.throttle_rate and pcs.random.random() < pcs.throttle_rate:
+            # downloads carry no errno, the file server answers with a 429
+            if endpoint == 'file':
+                return self.reply(429, b'{"error_code": 31034, "error_msg": "hit frequence limit"}')
+            return self.send_json({'errno': ERRNO_THROTTLED, 'request_id': 0})
+        if endpoint == 'file':
+            return self.send_file(int(url.path.rsplit('/', 1)[1]))
+        if endpoint == 'pcs_superfile2_upload':
+            return self.send_json(pcs.pcs_superfile2_upload(q, body))
+        form = {k: v[0] for k, v in parse_qs(body.decode(), keep_blank_values=True).items()} \
+            if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded') else {}
+        if endpoint == 'xpan_multimedia_filemetas':
+            return self.send_json(pcs.xpan_multimedia_filemetas(q, form, pcs.url))
+        handler = getattr(pcs, endpoint, None)
+        if handler is None:
+            return self.reply(404, b'{"errno": 2}')
+        self.send_json(handler(q, form))
+
+    def body_chunks(self):
+        length = int(self.headers.get('Content-Length', 0))
+        while length > 0:
+            chunk = self.rfile.read(min(length, THROTTLE_CHUNK))
+            if not chunk:
+                break
+            self.pcs.throttle.consume(len(chunk))
+            with self.pcs.lock:
+                self.pcs.bytes_in += len(chunk)
+            length -= len(chunk)
+            yield chunk
+
+    def read_body(self) -> bytes:
+        return b''.join(self.body_chunks())
+
+    def multipart_file(self, out):
+        """Streams the data of the body's "file" part into out, holding no
+        more than a chunk and a delimiter of the body in memory."""
+        boundary = re.search(r'boundary=([^;]+)', self.headers.get('Content-Type', '')).group(1).strip('"')
+        delim = b'\r\n--' + boundary.encode()
+        # the leading CRLF lets the first boundary match delim too
+        buf = b'\r\n'
+        in_part = writing = False
+        for chunk in self.body_chunks():
+            buf += chunk
+            while True:
+                if in_part:
+                    end = buf.find(delim)
+                    if end < 0:
+                        keep = max(0, len(buf) - len(delim) + 1)
+                        if writing:
+                            out.write(buf[:keep])
+                        buf = buf[keep:]
+                        break
+                    if writing:
+                        out.write(buf[:end])
+                    buf = buf[end:]
+                    in_part = False
+                if len(buf) < len(delim) + 2 or buf.startswith(delim + b'--'):
+                    break
+                head_end = buf.find(b'\r\n\r\n')
+                if head_end < 0:
+                    break
+                writing = b'name="file"' in buf[:head_end]
+                buf = buf[head_end + 4:]
+                in_part = True
+
+    def send_json(self, ret: Dict):
+        self.reply(200, json.dumps(ret).encode())
+
+    def reply(self, status: int, data: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_file(self, fs_id: int):
+        path = self.pcs.blob(fs_id)
+        if not os.path.exists(path):
+            return self.reply(404, b'{"errno": -9}')
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        if match:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            left = end - start + 1
+            while left > 0:
+                chunk = f.read(min(left, THROTTLE_CHUNK))
+                if not chunk:
+                    break
+                self.pcs.throttle.consume(len(chunk))
+                self.wfile.write(chunk)
+                left -= len(chunk)
+        with self.pcs.lock:
+            self.pcs.bytes_out += end - start + 1
@@ -24,11 +24,44 @@ class SyncDir(object):
     remote: str
     type: SyncType
     excludes: list[str]
+    concurrency: int
+    block_concurrency: int
+    rapid_upload: bool
+    metrics_file: str
+    prometheus_file: str
+    watch_debounce: float
+    reconcile_interval: float
+    poll_interval: float
+    connect_timeout: float
+    read_timeout: float
     def __init__(self, conf: dict[str, str]):
         self.local = check_field(conf, 'local_dir')
         self.remote = check_field(conf, 'remote_dir')
         self.type = SyncType(conf.get('type', 'download'))
         self.excludes = conf.get('excludes', [])
+        self.concurrency = int(conf.get('concurrency', 4))
+        if self.concurrency < 1:
+            raise Exception(f'config error: concurrency should be positive, got {self.concurrency}')
+        self.block_concurrency = int(conf.get('block_concurrency', 4))
+        if self.block_concurrency < 1:
+            raise Exception(f'config error: block_concurrency should be positive, got {self.block_concurrency}')
+        self.rapid_upload = bool(conf.get('rapid_upload', True))
+        self.metrics_file = conf.get('metrics_file', None)
+        self.prometheus_file = conf.get('prometheus_file', None)
+        # daemon mode only: seconds a changed path must be quiet before it is
+        # uploaded, between full passes, and between scans when inotify is
+        # not available
+        self.watch_debounce = float(conf.get('watch_debounce', 2))
+        self.reconcile_interval = float(conf.get('reconcile_interval', 3600))
+        if self.reconcile_interval <= 0:
+            raise Exception(f'config error: reconcile_interval should be positive, got {self.reconcile_interval}')
+        self.poll_interval = float(conf.get('poll_interval', 5))
+        # seconds before a dlink download gives up on connecting, or on a
+        # connection that stopped sending, and retries
+        self.connect_timeout = float(conf.get('connect_timeout', 10))
+        self.read_timeout = float(conf.get('read_timeout', 60))
+        if self.connect_timeout <= 0 or self.read_timeout <= 0:
+            raise Exception(f'config error: connect_timeout and read_timeout should be positive, got {self.connect_timeout}, {self.read_timeout}')
 
 class Config(object):
     def __init__(self, config_file):
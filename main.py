@@ -1,11 +1,14 @@
+import argparse
 import logging
 import os
+import signal
 import sys
+import threading
 sys.path.append(os.path.join(os.path.dirname(__file__), 'third_party', 'pcssdk'))
 from pprint import pprint
 from apiauth import apiauth
 from config import config
-from sync import sync
+from sync import daemon, sync
 
 def setup_logging():
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -18,7 +21,30 @@ def setup_logging():
     consoleHandler.setFormatter(formatter)
     rootLogger.addHandler(consoleHandler)
 
+def run_daemons(syncs):
+    daemons = []
+    for s, d in syncs:
+        daemons.append(daemon.SyncDaemon(s, debounce=d.watch_debounce, reconcile_interval=d.reconcile_interval,
+                                         poll_interval=d.poll_interval))
+    stop = lambda *args: [d.stop() for d in daemons]
+    signal.signal(signal.SIGTERM, stop)
+    threads = [threading.Thread(target=d.run, name=f'daemon-{i}') for i, d in enumerate(daemons)]
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(1)
+    except KeyboardInterrupt:
+        stop()
+        for t in threads:
+            t.join()
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running: watch upload dirs and upload changes as they happen')
+    args = parser.parse_args()
     setup_logging()
     conf = config.Config("pcs.yml")
     pprint(vars(conf))
@@ -33,9 +59,16 @@ if __name__ == '__main__':
         code = input()
         auth.setup_access_token(code)
     print("success. got access_token:", auth.get_access_token())
+    auth.start_refresher()
 
     logging.getLogger().info("start sync...")
-    for s in conf.sync:
-        s = sync.Sync(s.local, s.remote, auth, type=s.type, excludes=s.excludes, blocksize=20*1024*1024)
-        s.sync()
+    syncs = []
+    for d in conf.sync:
+        s = sync.Sync(d.local, d.remote, auth, type=d.type, excludes=d.excludes, blocksize=20*1024*1024, concurrency=d.concurrency, block_concurrency=d.block_concurrency, rapid_upload=d.rapid_upload, metrics_file=d.metrics_file, prometheus_file=d.prometheus_file, download_timeout=(d.connect_timeout, d.read_timeout))
+        syncs.append((s, d))
+    if args.daemon:
+        run_daemons(syncs)
+    else:
+        for s, _ in syncs:
+            s.sync()
 
@@ -0,0 +1,68 @@
+import logging
+import threading
+import time
+
+from config.config import SyncType
+from sync import watcher
+
+DEBOUNCE = 2.0
+RECONCILE_INTERVAL = 3600.0
+# how often a waiting daemon checks whether it was stopped
+STOP_CHECK = 1.0
+
+
+class SyncDaemon(object):
+    """Keeps one sync dir in sync until stopped.
+
+    A full pass runs at start and every reconcile_interval. In between,
+    upload dirs are watched and only the paths that changed are uploaded,
+    once they have been quiet for debounce seconds.
+    """
+
+    def __init__(self, s, debounce: float = DEBOUNCE, reconcile_interval: float = RECONCILE_INTERVAL,
+                 poll_interval: float = watcher.POLL_INTERVAL):
+        self.sync = s
+        self.debounce = debounce
+        self.reconcile_interval = reconcile_interval
+        self.poll_interval = poll_interval
+        self.queue = watcher.ChangeQueue()
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        s = self.sync
+        watch = None
+        if s.type == SyncType.UPLOAD or s.type == SyncType.UPDOWNLOAD:
+            # started ahead of the first pass, so that nothing changed
+            # while it runs is missed
+            watch = watcher.new_watcher(s.local, self.queue, s.excluded, self.poll_interval)
+        try:
+            self.run_sync()
+            next_full = time.monotonic() + self.reconcile_interval
+            while not self._stop.is_set():
+                wait = min(STOP_CHECK, max(0.0, next_full - time.monotonic()))
+                paths, overflow = set(), False
+                if watch is None:
+                    self._stop.wait(wait)
+                else:
+                    paths, overflow = self.queue.get(self.debounce, wait)
+                if overflow or time.monotonic() >= next_full:
+                    self.run_sync()
+                    next_full = time.monotonic() + self.reconcile_interval
+                elif paths:
+                    logging.info(f"{len(paths)} paths changed under {s.local}")
+                    self.run_sync(sorted(paths))
+        finally:
+            if watch is not None:
+                watch.stop()
+
+    def run_sync(self, paths=None):
+        s = self.sync
+        logging.info(f"{'full' if paths is None else 'incremental'} sync of {s.local} and {s.remote}")
+        try:
+            s.sync(paths)
+        except Exception as e:
+            # whatever failed is retried by a later event or the next full pass
+            logging.error(f"sync of {s.local} and {s.remote} failed: {e}")
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+
+HEADERS = {"User-Agent": "pan.baidu.com"}
+CHUNKSIZE = 256 * 1024
+# dlink fetches bypass the sdk rest client, so they retry on their own with
+# the same jittered exponential backoff
+RETRIES = 5
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 30.0
+# (connect, read) seconds; a connection that goes silent without a reset
+# must fail so the segment is retried instead of hanging its worker
+TIMEOUT = (10, 60)
+# dlinks carry a per file path, so their metrics share one endpoint label
+ENDPOINT = 'dlink'
+
+
+def retryable(e: Exception) -> bool:
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else 0
+        return status >= 500 or status == 429
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+def is_throttled(e: Exception) -> bool:
+    return isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 429
+
+
+def describe_error(e: Exception) -> str:
+    # requests puts the full url, access_token included, in its messages
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return f'{type(e).__name__} {e.response.status_code}'
+    if isinstance(e, requests.RequestException):
+        return type(e).__name__
+    return str(e)
+
+
+def with_retries(fn, *args, observer=None):
+    # observer is a Metrics, told of each retry like the api client's are
+    attempt = 0
+    while True:
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt >= RETRIES or not retryable(e):
+                raise
+            attempt += 1
+            if observer is not None:
+                observer.observe_retry(ENDPOINT, is_throttled(e))
+            wait = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+            logging.info(f"{describe_error(e)}, retry {attempt}/{RETRIES} in {wait:.2f}s")
+            time.sleep(wait)
+
+
+def fetch_file(url: str, tmp: str, timeout=TIMEOUT):
+    with requests.get(url, headers=HEADERS, stream=True, timeout=timeout) as req:
+        req.raise_for_status()
+        with open(tmp, 'wb') as f:
+            for chunk in req.iter_content(chunk_size=CHUNKSIZE):
+                if chunk:
+                    f.write(chunk)
+
+
+class SegmentedDownload(object):
+    """Fetches a file as concurrent byte ranges into a preallocated tmp file.
+
+    Finished segments are recorded in a sidecar next to the tmp file so that
+    an interrupted download continues where it stopped.
+    """
+
+    def __init__(self, url: str, tmp: str, size: int, segment_size: int, workers: int = 4, identity: Dict = {},
+                 timeout=TIMEOUT, observer=None):
+        self.url = url
+        self.timeout = timeout
+        self.observer = observer
+        self.tmp = tmp
+        self.sidecar = tmp + '.ranges'
+        self.size = size
+        self.segment_size = segment_size
+        self.workers = max(1, workers)
+        self.identity = dict(identity, size=size, segment_size=segment_size)
+        self.done: List[int] = []
+        self._lock = threading.Lock()
+
+    def segments(self) -> List[Tuple[int, int, int]]:
+        ret = []
+        for i, start in enumerate(range(0, self.size, self.segment_size)):
+            ret.append((i, start, min(start + self.segment_size, self.size) - 1))
+        return ret
+
+    def prepare(self):
+        state = {}
+        try:
+            with open(self.sidecar, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if state.get('identity') == self.identity and os.path.isfile(self.tmp) \
+                and os.path.getsize(self.tmp) == self.size:
+            self.done = state.get('done', [])
+            logging.info(f"resume download {self.tmp} with {len(self.done)}/{len(self.segments())} segments done")
+            return
+        self.done = []
+        with open(self.tmp, 'wb') as f:
+            f.truncate(self.size)
+        self._save()
+
+    def run(self):
+        self.prepare()
+        done = set(self.done)
+        todo = [s for s in self.segments() if s[0] not in done]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for future in [pool.submit(with_retries, self.fetch, *s, observer=self.observer) for s in todo]:
+                future.result()
+        os.remove(self.sidecar)
+
+    def fetch(self, i: int, start: int, end: int):
+        headers = dict(HEADERS, Range=f'bytes={start}-{end}')
+        with requests.get(self.url, headers=headers, stream=True, timeout=self.timeout) as req:
+            req.raise_for_status()
+            if req.status_code != 206:
+                raise Exception(f"range request {start}-{end} not honoured, status {req.status_code}")
+            written = 0
+            with open(self.tmp, 'r+b') as f:
+                f.seek(start)
+                for chunk in req.iter_content(chunk_size=CHUNKSIZE):
+                    if chunk:
+                        f.write(chunk)
+                        written += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        if written != end - start + 1:
+            raise Exception(f"range {start}-{end} got {written} bytes")
+        with self._lock:
+            self.done.append(i)
+            self._save()
+
+    def _save(self):
+        tmp = self.sidecar + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'identity': self.identity, 'done': self.done}, f)
+        os.replace(tmp, self.sidecar)
@@ -0,0 +1,125 @@
+import hashlib
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+# rapid upload identifies a file by the md5 of its first 256KB
+SLICE_SIZE = 256 * 1024
+# blocks are fed to the hashers in chunks small enough to stay in cache
+CHUNKSIZE = 1024 * 1024
+
+
+class FileDigest(object):
+    def __init__(self, size: int, block_list: List[str], content_md5: str, slice_md5: str):
+        self.size = size
+        self.block_list = block_list
+        self.content_md5 = content_md5
+        self.slice_md5 = slice_md5
+
+
+class FileChanged(Exception):
+    pass
+
+
+def hash_file(path: str, blocksize: int, use_mmap: bool = True) -> FileDigest:
+    """Computes the per-block md5 list, the whole-file md5 and the slice md5
+    in a single pass over the file.
+
+    With use_mmap the file is read through an mmap of the size fstat saw.
+    A file truncated while it is mapped raises SIGBUS and kills the process,
+    so only the hash pool workers map files; the sync process reads them
+    with readinto into a reused buffer.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            empty = hashlib.md5().hexdigest()
+            return FileDigest(0, [], empty, empty)
+        if use_mmap:
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as m, memoryview(m) as data:
+                return _digest(path, size, blocksize, lambda off, n: data[off:off + n])
+        with memoryview(bytearray(CHUNKSIZE)) as buf:
+            return _digest(path, size, blocksize, lambda off, n: buf[:f.readinto(buf[:n])])
+
+
+def _digest(path: str, size: int, blocksize: int, read) -> FileDigest:
+    # read(offset, n) is called with consecutive offsets and returns a view
+    # of at most n bytes, fewer only at end of file
+    content = hashlib.md5()
+    first = hashlib.md5()
+    block_list = []
+    pos = 0
+    while pos < size:
+        end = min(pos + blocksize, size)
+        block = hashlib.md5()
+        while pos < end:
+            with read(pos, min(CHUNKSIZE, end - pos)) as chunk:
+                if not len(chunk):
+                    raise FileChanged(f"{path} shrank from {size} to {pos} bytes while hashing")
+                block.update(chunk)
+                content.update(chunk)
+                if pos < SLICE_SIZE:
+                    first.update(chunk[:SLICE_SIZE - pos])
+                pos += len(chunk)
+        block_list.append(block.hexdigest())
+    return FileDigest(size, block_list, content.hexdigest(), first.hexdigest())
+
+
+def new_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn rather than fork: the pool is started from a process that is
+    # already running transfer threads
+    return ProcessPoolExecutor(max_workers=max(1, min(workers, os.cpu_count() or 1)),
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def hash_files(paths: List[str], blocksize: int, workers: int = 0) -> Dict[str, FileDigest]:
+    with new_pool(workers or os.cpu_count() or 1) as pool:
+        return dict(zip(paths, pool.map(hash_file, paths, [blocksize] * len(paths))))
+
+
+def read_md5_blocks(path: str, blocksize: int) -> List[str]:
+    # a plain read loop over the file, kept as the benchmark baseline
+    with open(path, 'rb') as f:
+        blocks = []
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            blocks.append(hashlib.md5(block).hexdigest())
+        return blocks
+
+
+def read_content_md5(path: str) -> str:
+    content = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNKSIZE)
+            if not chunk:
+                return content.hexdigest()
+            content.update(chunk)
+
+
+def benchmark(paths: List[str], blocksize: int):
+    total = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+    # md5_blocks alone does not produce the content md5; the second row is
+    # what getting the same digests takes without hash_file
+    for name, fn in [('md5_blocks', lambda: [read_md5_blocks(p, blocksize) for p in paths]),
+                     ('md5_blocks+md5', lambda: [(read_md5_blocks(p, blocksize), read_content_md5(p)) for p in paths]),
+                     ('hash_file', lambda: [hash_file(p, blocksize) for p in paths]),
+                     ('hash_files', lambda: hash_files(paths, blocksize))]:
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        print(f'{name:>14}: {total:.1f} MB in {elapsed:.3f}s, {total / elapsed:.1f} MB/s')
+
+
+if __name__ == '__main__':
+    # python -m sync.hasher FILE... : compare hashing throughput
+    if len(sys.argv) < 2:
+        print(f'usage: {sys.argv[0]} FILE...')
+        sys.exit(1)
+    benchmark(sys.argv[1:], 4 * 1024 * 1024)
@@ -0,0 +1,111 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+INDEX_FILE = '.sync_index.db'
+
+
+class SyncIndex(object):
+    """On-disk record of what each local path looked like at its last sync.
+
+    Rows are keyed by local path and hold the local stat, the block md5
+    list and the remote fs_id/server_mtime/md5, so a later run can skip
+    unchanged entries without hashing or listing.
+    """
+
+    def __init__(self, index_file: str = INDEX_FILE):
+        self.index_file = index_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(index_file, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, remote TEXT NOT NULL, isdir INTEGER NOT NULL, '
+                'size INTEGER, mtime_ns INTEGER, inode INTEGER, block_list TEXT, '
+                'fs_id INTEGER, server_mtime INTEGER, md5 TEXT)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS remote_snapshot ('
+                'root TEXT NOT NULL, path TEXT NOT NULL, isdir INTEGER, '
+                'fs_id INTEGER, server_mtime INTEGER, md5 TEXT, PRIMARY KEY (root, path))')
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def get(self, path: str) -> Optional[Dict]:
+        with self._lock:
+            cur = self.conn.execute('SELECT * FROM files WHERE path = ?', (path,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            ret = dict(zip([d[0] for d in cur.description], row))
+        ret['block_list'] = json.loads(ret['block_list']) if ret['block_list'] else []
+        return ret
+
+    def has_dir(self, path: str, remote: str) -> bool:
+        row = self.get(path)
+        return row is not None and row['isdir'] == 1 and row['remote'] == remote
+
+    def unchanged(self, path: str, remote: str, stat: os.stat_result, remote_meta: Optional[Dict] = None) -> bool:
+        row = self.get(path)
+        if row is None or row['isdir'] or row['remote'] != remote:
+            return False
+        if (row['size'], row['mtime_ns'], row['inode']) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return False
+        if remote_meta is not None:
+            return (row['fs_id'], row['server_mtime'], row['md5']) == (
+                remote_meta.get('fs_id'), remote_meta.get('server_mtime'), remote_meta.get('md5'))
+        return True
+
+    def dir_unchanged(self, path: str, remote: str, stat: os.stat_result) -> bool:
+        # adding, removing or renaming an entry bumps the dir's own mtime
+        row = self.get(path)
+        return row is not None and row['isdir'] == 1 and row['remote'] == remote \
+            and row['mtime_ns'] == stat.st_mtime_ns
+
+    def put_dir(self, path: str, remote: str):
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files (path, remote, isdir) VALUES (?, ?, 1)', (path, remote))
+
+    def put_dirs(self, dirs: List[tuple]):
+        # (path, remote, stat) of local dirs as left by a clean download pass
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO files (path, remote, isdir, mtime_ns) VALUES (?, ?, 1, ?)',
+                ((path, remote, stat.st_mtime_ns) for path, remote, stat in dirs))
+
+    def put(self, path: str, remote: str, stat: os.stat_result, remote_meta: Dict, block_list: List[str] = []):
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?, ?)',
+                (path, remote, stat.st_size, stat.st_mtime_ns, stat.st_ino, json.dumps(block_list),
+                 remote_meta.get('fs_id'), remote_meta.get('server_mtime'), remote_meta.get('md5')))
+
+    def remote_snapshot(self, root: str) -> Dict[str, tuple]:
+        with self._lock:
+            cur = self.conn.execute(
+                'SELECT path, isdir, fs_id, server_mtime, md5 FROM remote_snapshot WHERE root = ?', (root,))
+            return {row[0]: tuple(row[1:]) for row in cur}
+
+    def replace_remote_snapshot(self, root: str, snapshot: Dict[str, tuple]):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM remote_snapshot WHERE root = ?', (root,))
+            self.conn.executemany(
+                'INSERT INTO remote_snapshot VALUES (?, ?, ?, ?, ?, ?)',
+                ((root, path) + tuple(v) for path, v in snapshot.items()))
+
+    def remove(self, path: str):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def remove_tree(self, path: str):
+        # path and every row below it; substr rather than LIKE, as paths
+        # may hold % and _
+        prefix = os.path.join(path, '')
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM files WHERE path = ? OR substr(path, 1, ?) = ?',
+                              (path, len(prefix), prefix))
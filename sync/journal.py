@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+JOURNAL_DIR = '.upload_journal'
+# an uploadid is only honoured by the server for a limited time
+SESSION_TTL = 20 * 3600
+
+
+class UploadJournal(object):
+    """Persists in-progress upload sessions, one json file per destination."""
+
+    def __init__(self, journal_dir: str = JOURNAL_DIR, ttl: float = SESSION_TTL):
+        self.journal_dir = journal_dir
+        self.ttl = ttl
+
+    def path(self, dst: str) -> str:
+        return os.path.join(self.journal_dir, hashlib.md5(dst.encode('utf-8')).hexdigest() + '.json')
+
+    def new_entry(self, dst: str, stat: os.stat_result, blocksize: int, uploadid: str, block_list: List[str]) -> Dict:
+        return {
+            'dst': dst,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'blocksize': blocksize,
+            'uploadid': uploadid,
+            'block_list': block_list,
+            'acked': [],
+            'created_at': time.time(),
+        }
+
+    def load(self, dst: str, stat: os.stat_result, blocksize: int) -> Optional[Dict]:
+        try:
+            with open(self.path(dst), 'r') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.info(f"drop unreadable upload journal for {dst}: {e}")
+            self.remove(dst)
+            return None
+        if entry.get('dst') != dst or entry.get('size') != stat.st_size \
+                or entry.get('mtime_ns') != stat.st_mtime_ns or entry.get('blocksize') != blocksize:
+            logging.info(f"drop upload journal for {dst}: local file changed")
+            self.remove(dst)
+            return None
+        if time.time() - entry.get('created_at', 0) > self.ttl:
+            logging.info(f"drop upload journal for {dst}: session expired")
+            self.remove(dst)
+            return None
+        return entry
+
+    def save(self, entry: Dict):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        path = self.path(entry['dst'])
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+    def ack(self, entry: Dict, partseq: int):
+        entry['acked'].append(partseq)
+        self.save(entry)
+
+    def remove(self, dst: str):
+        try:
+            os.remove(self.path(dst))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,153 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# upper bounds in seconds, from a cached listing page to a slow 20MB block
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+PREFIX = 'pcs_sync'
+
+
+class Histogram(object):
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        # the upper bound of the bucket holding the q-th observation, the
+        # same approximation histogram_quantile makes, capped by the max
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {'count': self.count, 'sum': round(self.sum, 6), 'max': round(self.max, 6),
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+def label_str(labels: Tuple) -> str:
+    return ','.join(str(v) for _, v in labels)
+
+
+class Metrics(object):
+    """Thread-safe counters, gauges and latency histograms of one sync run.
+
+    Sync times its phases with timer(); the sdk rest client reports every
+    request attempt through observe_request/observe_retry and Auth its token
+    refreshes. summary() is the per-run JSON record, prometheus() the same
+    data in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.gauges: Dict[Tuple[str, Tuple], float] = {}
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    @contextmanager
+    def timer(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('phase_seconds', time.perf_counter() - start, phase=phase)
+
+    def observe_request(self, endpoint: str, status, seconds: float):
+        self.observe('request_seconds', seconds, endpoint=endpoint)
+        if status != 200 and status != 206:
+            self.inc('request_errors', endpoint=endpoint, status=str(status))
+
+    def observe_retry(self, endpoint: str, throttled: bool):
+        self.inc('retries', endpoint=endpoint)
+        if throttled:
+            self.inc('throttled', endpoint=endpoint)
+
+    def counter(self, name: str) -> float:
+        # total over all label values
+        with self.lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def summary(self) -> Dict:
+        ret = {'started': self.started, 'seconds': round(time.time() - self.started, 3)}
+        with self.lock:
+            for kind, items in [('histograms', self.histograms), ('counters', self.counters),
+                                ('gauges', self.gauges)]:
+                group = ret.setdefault(kind, {})
+                for (name, labels), value in sorted(items.items()):
+                    group.setdefault(name, {})[label_str(labels)] = \
+                        value.to_dict() if isinstance(value, Histogram) else value
+        return ret
+
+    def prometheus(self, prefix: str = PREFIX, **labels) -> str:
+        lines: List[str] = []
+
+        def fmt(extra: Tuple) -> str:
+            pairs = sorted(labels.items()) + list(extra)
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else ''
+
+        with self.lock:
+            for kind, items, suffix in [('histogram', self.histograms, ''), ('counter', self.counters, '_total'),
+                                        ('gauge', self.gauges, '')]:
+                typed = set()
+                for (name, extra), value in sorted(items.items()):
+                    metric = f'{prefix}_{name}{suffix}'
+                    if metric not in typed:
+                        typed.add(metric)
+                        lines.append(f'# TYPE {metric} {kind}')
+                    if not isinstance(value, Histogram):
+                        lines.append(f'{metric}{fmt(extra)} {value}')
+                        continue
+                    seen = 0
+                    for bound, n in zip(value.buckets + ('+Inf',), value.counts):
+                        seen += n
+                        lines.append(f'{metric}_bucket{fmt(extra + (("le", bound),))} {seen}')
+                    lines.append(f'{metric}_sum{fmt(extra)} {value.sum}')
+                    lines.append(f'{metric}_count{fmt(extra)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def append_json(path: str, record: Dict):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def write_text(path: str, text: str):
+    # replaced atomically, a textfile collector never sees half a dump
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,98 @@
+import logging
+import os
+from typing import Dict, Set
+
+from openapi_client.api import fileinfo_api, multimediafile_api
+
+# the largest page either listing endpoint accepts
+LIST_LIMIT = 1000
+# errno of a listing whose dir does not exist
+ERRNO_NOT_FOUND = -9
+
+
+class ScanException(Exception):
+    pass
+
+
+class RemoteDirMissing(ScanException):
+    pass
+
+
+def normpath(path: str) -> str:
+    return path.rstrip('/') or '/'
+
+
+class RemoteScanner(object):
+    def __init__(self, api_client, auth, limit: int = LIST_LIMIT):
+        self.api_client = api_client
+        self.auth = auth
+        self.limit = limit
+
+    def list_dir(self, path: str) -> Dict[str, Dict]:
+        ret = {}
+        api_instance = fileinfo_api.FileinfoApi(self.api_client)
+        start = 0
+        while True:
+            api_response = api_instance.xpanfilelist(
+                self.auth.get_access_token(), dir=path, showempty=1, start=str(start), limit=self.limit)
+            if api_response.get('errno', -1) == ERRNO_NOT_FOUND:
+                raise RemoteDirMissing(f"xpanfilelist {path} error: {api_response}")
+            if api_response.get('errno', -1) != 0:
+                raise ScanException(f"xpanfilelist {path} error: {api_response}")
+            page = api_response.get('list', [])
+            for file in page:
+                ret[file.get('server_filename')] = file
+            if len(page) < self.limit:
+                return ret
+            start += len(page)
+
+    def list_tree(self, path: str) -> Dict[str, Dict[str, Dict]]:
+        # one recursive listall walk, regrouped as parent dir -> name -> entry
+        # so that it can stand in for per-directory list calls
+        root = normpath(path)
+        tree = {root: {}}
+        api_instance = multimediafile_api.MultimediafileApi(self.api_client)
+        start = 0
+        pages = 0
+        while True:
+            api_response = api_instance.xpanfilelistall(
+                self.auth.get_access_token(), root, 1, start=start, limit=self.limit)
+            if api_response.get('errno', -1) != 0:
+                raise ScanException(f"xpanfilelistall {root} error: {api_response}")
+            pages += 1
+            for file in api_response.get('list', []):
+                file_path = normpath(file.get('path', ''))
+                tree.setdefault(os.path.dirname(file_path), {})[os.path.basename(file_path)] = file
+                if file.get('isdir', 0) == 1:
+                    tree.setdefault(file_path, {})
+            if not api_response.get('has_more', 0):
+                break
+            start = api_response.get('cursor', start + self.limit)
+        logging.info(f"listall {root} got {sum(len(d) for d in tree.values())} entries in {pages} pages")
+        return tree
+
+
+def snapshot_of(tree: Dict[str, Dict[str, Dict]]) -> Dict[str, tuple]:
+    ret = {}
+    for parent, files in tree.items():
+        for name, file in files.items():
+            ret[os.path.join(parent, name)] = (
+                file.get('isdir', 0), file.get('fs_id'), file.get('server_mtime'), file.get('md5'))
+    return ret
+
+
+def changed_dirs(root: str, prev: Dict[str, tuple], cur: Dict[str, tuple]) -> Set[str]:
+    """Directories that contain a changed, added or removed entry, plus
+    all of their ancestors up to root."""
+    root = normpath(root)
+    ret = set()
+    for path in set(prev) | set(cur):
+        if prev.get(path) == cur.get(path):
+            continue
+        parent = os.path.dirname(path)
+        while parent not in ret:
+            ret.add(parent)
+            if parent == root or len(parent) <= len(root):
+                break
+            parent = os.path.dirname(parent)
+    return ret
@@ -0,0 +1,87 @@
+import logging
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_WORKERS = 4
+
+
+class TransferJob(object):
+    def __init__(self, seq: int, desc: str, fn: Callable, args: tuple):
+        self.seq = seq
+        self.desc = desc
+        self.fn = fn
+        self.args = args
+
+
+class TransferScheduler(object):
+    """Runs queued file transfers on a bounded pool of worker threads.
+
+    Completion is logged in submission order, and a failed job is recorded
+    instead of aborting the remaining ones; join() returns the failures.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, backlog: int = 0):
+        self.workers = max(1, workers)
+        # bounded so that the tree walk cannot run far ahead of the workers
+        self.queue: queue.Queue = queue.Queue(maxsize=backlog or self.workers * 2)
+        self.errors: List[Tuple[str, Exception]] = []
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._next_seq = 0
+        self._next_log = 0
+        self._finished: Dict[int, Tuple[str, Optional[Exception]]] = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.join()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f'transfer-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, desc: str, fn: Callable, *args):
+        if not self._threads:
+            self.start()
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+        self.queue.put(TransferJob(seq, desc, fn, args))
+
+    def join(self) -> List[Tuple[str, Exception]]:
+        for _ in self._threads:
+            self.queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        return self.errors
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            err = None
+            try:
+                job.fn(*job.args)
+            except Exception as e:
+                err = e
+            self._finish(job.seq, job.desc, err)
+
+    def _finish(self, seq: int, desc: str, err: Optional[Exception]):
+        with self._lock:
+            if err is not None:
+                self.errors.append((desc, err))
+            self._finished[seq] = (desc, err)
+            while self._next_log in self._finished:
+                desc, err = self._finished.pop(self._next_log)
+                self._next_log += 1
+                if err is None:
+                    logging.info(f'{desc} success')
+                else:
+                    logging.error(f'{desc} failed: {err}')
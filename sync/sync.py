@@ -1,39 +1,92 @@
+import collections
 import datetime
-from io import BytesIO
+import json
 import logging
 import os
 import re
-import hashlib
-from typing import Dict, List
-
-import requests
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Set
 
 from apiauth import apiauth
 from config.config import SyncType
-from third_party.pcssdk.openapi_client import api_client, exceptions
-from third_party.pcssdk.openapi_client.api import fileupload_api, fileinfo_api, multimediafile_api
+from sync import download, hasher, index, journal, metrics, scanner, scheduler
+from openapi_client import api_client, exceptions, rest
+from openapi_client.api import fileupload_api, multimediafile_api
+from openapi_client.configuration import Configuration
 
 BLOCKSIZE=4*104*1024
-
-class NameBytesIO(BytesIO):
-    def __init__(self, file: str, block: bytes):
-        super().__init__(block)
-        self.name = file
-
+BLOCK_CONCURRENCY=4
+HASH_POOL_MIN_SIZE=4*1024*1024
 
 class SyncException(Exception):
     def __init__(self, *args: object) -> None:
         super().__init__(*args)
 
 
+class UploadSessionException(SyncException):
+    pass
+
+
+class RemoteDirMissingException(SyncException):
+    pass
+
+
+class RapidUploadStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = 0
+        self.hits = 0
+        self.bytes_saved = 0
+
+    def record(self, size: int, hit: bool):
+        with self.lock:
+            self.attempts += 1
+            if hit:
+                self.hits += 1
+                self.bytes_saved += size
+
+    def __str__(self) -> str:
+        rate = self.hits / self.attempts if self.attempts else 0.0
+        return f"rapid upload hit {self.hits}/{self.attempts} ({rate:.1%}), {self.bytes_saved} bytes not sent"
+
+
 class Sync(object):
-    def __init__(self, local: str, remote: str, auth: apiauth.Auth, type=SyncType.DOWNLOAD, excludes: List[str] = [], blocksize=BLOCKSIZE):
+    def __init__(self, local: str, remote: str, auth: apiauth.Auth, type=SyncType.DOWNLOAD, excludes: List[str] = [], blocksize=BLOCKSIZE, concurrency=scheduler.DEFAULT_WORKERS, block_concurrency=BLOCK_CONCURRENCY, journal_dir=journal.JOURNAL_DIR, index_file=index.INDEX_FILE, bulk_scan=True, rapid_upload=True, configuration=None, metrics_file=None, prometheus_file=None, download_timeout=download.TIMEOUT):
         self.local = local
         self.remote = remote
         self.type = type
         self.auth = auth
-        self.api_client = api_client.ApiClient()
+        pool_threads = concurrency * block_concurrency
+        if configuration is None:
+            configuration = Configuration.get_default_copy()
+        # a connection per thread that can have a request in flight; this
+        # is also the ceiling of the rest client's adaptive in-flight limit
+        configuration.connection_pool_maxsize = max(configuration.connection_pool_maxsize, pool_threads)
+        self.api_client = api_client.ApiClient(configuration, pool_threads=pool_threads, fast_deserialize=True)
         self.blocksize = blocksize
+        self.concurrency = concurrency
+        self.block_concurrency = max(1, block_concurrency)
+        self.journal = journal.UploadJournal(journal_dir)
+        self.index = index.SyncIndex(index_file)
+        self.scanner = scanner.RemoteScanner(self.api_client, auth)
+        self.bulk_scan = bulk_scan
+        self.remote_tree = None
+        self.remote_changed = None
+        self.scheduler = None
+        self.hash_pool = None
+        self.hash_pool_lock = threading.Lock()
+        # (src, dst) of dirs found deleted remotely during the upload walk
+        self.recreated = []
+        self.rapid_upload = rapid_upload
+        self.rapid_stats = RapidUploadStats()
+        self.download_timeout = download_timeout
+        self.metrics = metrics.Metrics()
+        # a json line per run is appended to metrics_file, prometheus_file
+        # holds the text dump of the latest run
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
         self.excludes = []
         for exclude in excludes:
             logging.info(f"exclude {exclude}")
@@ -45,30 +98,160 @@ class Sync(object):
                 return True
         return False
 
-    def sync(self):
+    def sync(self, paths: Optional[List[str]] = None):
+        # with paths, only those local files and dirs are uploaded; this is
+        # what the watch daemon runs between full passes
+        self.metrics = metrics.Metrics()
+        self.api_client.rest_client.observer = self.metrics
+        self.auth.add_observer(self.metrics)
+        try:
+            self.sync_dirs(paths)
+        finally:
+            self.auth.remove_observer(self.metrics)
+            self.report_metrics()
+
+    def sync_dirs(self, paths: Optional[List[str]] = None):
+        errors = []
         if self.type == SyncType.UPLOAD or self.type == SyncType.UPDOWNLOAD:
-            self.sync_up_dir(self.local, self.remote)
-        if self.type == SyncType.DOWNLOAD or self.type == SyncType.UPDOWNLOAD:
-            self.sync_down_dir(self.remote, self.local)
+            self.hash_pool = hasher.new_pool(self.concurrency)
+            self.rapid_stats = RapidUploadStats()
+            walk = self.sync_up_dir
+            if paths is not None:
+                walk = lambda src_dir, dst_dir: self.sync_up_paths(paths)
+            try:
+                with self.metrics.timer('upload_phase'):
+                    self.recreated = []
+                    errors += self.run_transfers(walk, self.local, self.remote)
+                    # entries the walk had skipped as synced before it found
+                    # their remote dir gone are uploaded in a second pass
+                    recreated, self.recreated = self.recreated, []
+                    if recreated:
+                        errors += self.run_transfers(
+                            lambda src_dir, dst_dir: [self.sync_up_dir(s, d) for s, d in recreated],
+                            self.local, self.remote)
+            finally:
+                self.hash_pool.shutdown()
+                self.hash_pool = None
+            if self.rapid_upload:
+                logging.info(f"sync {self.local} to {self.remote}: {self.rapid_stats}")
+        if paths is None and (self.type == SyncType.DOWNLOAD or self.type == SyncType.UPDOWNLOAD):
+            try:
+                with self.metrics.timer('download_phase'):
+                    snapshot = self.scan_remote(self.remote)
+                    down_errors = self.run_transfers(self.sync_down_dir, self.remote, self.local)
+                # a failed file must be looked at again next run, so the
+                # snapshot only advances after a clean pass
+                if snapshot is not None and not down_errors:
+                    self.index.replace_remote_snapshot(scanner.normpath(self.remote), snapshot)
+                    self.record_local_dirs(self.remote)
+            finally:
+                self.remote_tree = None
+                self.remote_changed = None
+            errors += down_errors
+        if errors:
+            self.metrics.inc('files_failed', len(errors))
+            desc, e = errors[0]
+            raise SyncException(
+                f"{len(errors)} files failed to sync between {self.local} and {self.remote}, first: {desc}: {e}")
+
+    def report_metrics(self):
+        limiter = self.api_client.rest_client.limiter
+        if limiter is not None:
+            self.metrics.set('inflight_limit', limiter.limit)
+        summary = dict(self.metrics.summary(), local=self.local, remote=self.remote, type=self.type.value,
+                       blocksize=self.blocksize, concurrency=self.concurrency,
+                       block_concurrency=self.block_concurrency)
+        logging.info(f"sync metrics: {json.dumps(summary)}")
+        if self.metrics_file:
+            metrics.append_json(self.metrics_file, summary)
+        if self.prometheus_file:
+            metrics.write_text(self.prometheus_file, self.metrics.prometheus(local=self.local, remote=self.remote))
+
+    def run_transfers(self, walk, src_dir: str, dst_dir: str) -> List:
+        # the walk queues file jobs; the scheduler is drained before the
+        # next phase so that download never races an in-flight upload
+        self.scheduler = scheduler.TransferScheduler(self.concurrency)
+        try:
+            with self.scheduler:
+                walk(src_dir, dst_dir)
+        finally:
+            errors = self.scheduler.errors
+            self.scheduler = None
+        return errors
 
     def sync_up_dir(self, src_dir: str, dst_dir: str):
         if self.excluded(src_dir):
             logging.info(f"skip excluded dir {src_dir}")
             return
-        remote_files = self.remote_ls(dst_dir)
-        logging.info(f"remote_ls on {dst_dir} got: {remote_files}")
-        for file in os.listdir(src_dir):
+        # listed lazily: a directory whose entries all match the index
+        # needs no remote round trip at all
+        remote_files = None
+        for entry in os.scandir(src_dir):
+            file = entry.name
             if file.startswith('.'):
                 continue
-            src = os.path.join(src_dir, file)
+            src = entry.path
             dst = os.path.join(dst_dir, file)
+            if entry.is_dir():
+                if not self.index.has_dir(src, dst):
+                    if remote_files is None:
+                        remote_files = self.list_up_dir(src_dir, dst_dir)
+                    if file not in remote_files:
+                        self.remote_mkdir(dst)
+                    self.index.put_dir(src, dst)
+                self.sync_up_dir(src, dst)
+                continue
+            stat = entry.stat()
+            if self.index.unchanged(src, dst, stat):
+                continue
+            if remote_files is None:
+                remote_files = self.list_up_dir(src_dir, dst_dir)
+            if file not in remote_files or stat.st_mtime > remote_files[file].get('server_mtime', 0):
+                self.submit(f'sync file {src}', self.sync_up_file, src, dst)
+            else:
+                # remote columns are only recorded after a real transfer, so
+                # the download pass still pulls a remote copy that is newer
+                self.index.put(src, dst, stat, {})
+
+    def sync_up_paths(self, paths: List[str]):
+        queued = set()
+        for src in sorted(paths):
+            # a dir that is synced as a whole covers everything below it
+            if any(src.startswith(d + os.sep) for d in queued):
+                continue
+            rel = os.path.relpath(src, self.local)
+            if rel == '.' or rel.startswith('..') or any(p.startswith('.') for p in rel.split(os.sep)):
+                continue
+            if any(self.excluded(a) for a in self.ancestors(src)):
+                logging.info(f"skip excluded path {src}")
+                continue
+            dst = os.path.join(self.remote, rel)
             if os.path.isdir(src):
-                if file not in remote_files:
-                    self.remote_mkdir(dst)
+                self.ensure_remote_dir(src, dst)
                 self.sync_up_dir(src, dst)
-            elif file not in remote_files or os.path.getmtime(src) > remote_files[file].get('server_mtime', 0):
-                self.sync_up_file(src, dst)
-        pass
+                queued.add(src)
+            elif os.path.isfile(src):
+                self.ensure_remote_dir(os.path.dirname(src), os.path.dirname(dst))
+                if not self.index.unchanged(src, dst, os.stat(src)):
+                    self.submit(f'sync file {src}', self.sync_up_file, src, dst)
+
+    def ancestors(self, src: str) -> List[str]:
+        # src and the dirs between it and the sync root
+        root = os.path.normpath(self.local)
+        ret = []
+        src = os.path.normpath(src)
+        while src.startswith(root + os.sep):
+            ret.append(src)
+            src = os.path.dirname(src)
+        return ret
+
+    def ensure_remote_dir(self, src: str, dst: str):
+        if os.path.normpath(src) == os.path.normpath(self.local) or self.index.has_dir(src, dst):
+            return
+        self.ensure_remote_dir(os.path.dirname(src), os.path.dirname(dst))
+        if os.path.basename(dst) not in self.list_up_dir(os.path.dirname(src), os.path.dirname(dst)):
+            self.remote_mkdir(dst)
+        self.index.put_dir(src, dst)
 
     def sync_up_file(self, src: str, dst: str):
         if self.excluded(src):
@@ -76,10 +259,24 @@ class Sync(object):
             return
         logging.info(f'uploading file {src}')
         self.upload_file(self.auth.get_access_token(), src, dst)
-        logging.info(f'sync file {src} success')
+
+    def sync_down_file(self, fsid: int, dst: str, remote_path: str):
+        logging.info(f'downloading file {dst}')
+        with self.metrics.timer('download'):
+            meta = self.download_file(self.auth.get_access_token(), fsid, dst)
+        self.metrics.inc('files_downloaded')
+        self.metrics.inc('bytes_downloaded', meta.get('size', 0))
+        self.index.put(dst, remote_path, os.stat(dst), meta)
+
+    def submit(self, desc: str, fn, *args):
+        if self.scheduler is None:
+            fn(*args)
+            logging.info(f'{desc} success')
+            return
+        self.scheduler.submit(desc, fn, *args)
 
     def sync_down_dir(self, src_dir: str, dst_dir: str):
-        remote_files = self.remote_ls(src_dir)
+        remote_files = self.remote_listing(src_dir)
         logging.info(f"remote_ls on {src_dir} got: {remote_files}")
         for remote_file in remote_files:
             ts_now = datetime.datetime.now().timestamp()
@@ -92,43 +289,130 @@ class Sync(object):
                     logging.info(
                         f"rename {local_file} to {local_file}.{ts_now}")
                     os.rename(local_file, f'{local_file}.{ts_now}')
-                if not os.path.exists(local_file):
+                missing = not os.path.exists(local_file)
+                if missing:
                     os.mkdir(local_file)
-                self.sync_down_dir(os.path.join(
-                    src_dir, remote_file), local_file)
+                remote_dir = os.path.join(src_dir, remote_file)
+                if missing or self.remote_changed is None or scanner.normpath(remote_dir) in self.remote_changed:
+                    self.sync_down_dir(remote_dir, local_file)
                 continue
             if os.path.exists(local_file) and not os.path.isfile(local_file):
                 logging.info(
                     f"rename {local_file} to {local_file}.{ts_now}")
                 os.rename(local_file, f'{local_file}.{ts_now}')
+            if os.path.exists(local_file) and self.index.unchanged(
+                    local_file, os.path.join(src_dir, remote_file), os.stat(local_file), remote_files[remote_file]):
+                continue
             if os.path.exists(local_file) and os.path.getmtime(local_file) > remote_files[remote_file].get('server_mtime', 0):
                 logging.info(
                     f"skip download {remote_file} as local file is newer")
                 continue
-            self.download_file(self.auth.get_access_token(
-            ), remote_files[remote_file].get('fs_id', 0), local_file)
+            self.submit(f'sync file {local_file}', self.sync_down_file,
+                        remote_files[remote_file].get('fs_id', 0), local_file, os.path.join(src_dir, remote_file))
 
     def remote_ls(self, path: str) -> Dict[str, Dict]:
-        ret = {}
-        api_instance = fileinfo_api.FileinfoApi(self.api_client)
         try:
-            api_response = api_instance.xpanfilelist(
-                self.auth.get_access_token(), dir=path, showempty=1)
-            if api_response.get('errno', -1) != 0:
-                raise SyncException(
-                    f"xpanfilelist {path} error: {api_response}")
-            for file in api_response.get('list', []):
-                ret[file.get('server_filename')] = file
+            with self.metrics.timer('scan'):
+                return self.scanner.list_dir(path)
+        except scanner.RemoteDirMissing as e:
+            raise RemoteDirMissingException(str(e))
+        except scanner.ScanException as e:
+            raise SyncException(str(e))
         except exceptions.ApiException as e:
             raise SyncException(
                 f"remote_ls {path} raised pcssdk Exception: {e}")
+
+    def list_up_dir(self, src_dir: str, dst_dir: str) -> Dict[str, Dict]:
+        # the index remembers dirs as created, so one deleted remotely is
+        # only noticed here; it is recreated rather than failing every run
+        try:
+            return self.remote_ls(dst_dir)
+        except RemoteDirMissingException:
+            pass
+        top_src, top_dst = src_dir, dst_dir
+        while os.path.normpath(top_src) != os.path.normpath(self.local):
+            try:
+                self.remote_ls(os.path.dirname(top_dst))
+                break
+            except RemoteDirMissingException:
+                top_src, top_dst = os.path.dirname(top_src), os.path.dirname(top_dst)
+        logging.warning(f"remote dir {top_dst} is gone, recreate it and upload {top_src} again")
+        self.index.remove_tree(top_src)
+        self.remote_mkdir(dst_dir)
+        if os.path.normpath(src_dir) != os.path.normpath(self.local):
+            self.index.put_dir(src_dir, dst_dir)
+        self.recreated.append((top_src, top_dst))
+        return {}
+
+    def remote_listing(self, path: str) -> Dict[str, Dict]:
+        if self.remote_tree is not None:
+            return self.remote_tree.get(scanner.normpath(path), {})
+        return self.remote_ls(path)
+
+    def scan_remote(self, root: str):
+        if not self.bulk_scan:
+            return
+        try:
+            with self.metrics.timer('scan'):
+                self.remote_tree = self.scanner.list_tree(root)
+        except Exception as e:
+            logging.info(f"bulk scan of {root} failed, fall back to listing each dir: {e}")
+            return
+        snapshot = scanner.snapshot_of(self.remote_tree)
+        prev = self.index.remote_snapshot(scanner.normpath(root))
+        if prev:
+            self.remote_changed = scanner.changed_dirs(root, prev, snapshot)
+            local_changed = self.local_changed_dirs(root)
+            logging.info(f"{len(self.remote_changed)} remote dirs changed under {root} since last sync, "
+                         f"{len(local_changed)} local dirs")
+            self.remote_changed |= local_changed
+        return snapshot
+
+    def local_dirs(self, root: str):
+        # (local path, remote path) of every dir in the bulk scan
+        for remote_dir in self.remote_tree:
+            rel = os.path.relpath(remote_dir, root)
+            if rel != '.' and any(self.excluded(name) for name in rel.split(os.sep)):
+                continue
+            yield os.path.normpath(os.path.join(self.local, rel)), remote_dir
+
+    def local_changed_dirs(self, root: str) -> Set[str]:
+        """Remote dirs whose local copy had an entry added, removed or
+        renamed since the last clean pass, plus their ancestors up to root.
+        Costs a stat per dir rather than per file; a file modified in place
+        is left to the upload walk, or kept as the newer copy."""
+        root = scanner.normpath(root)
+        ret = set()
+        for local_dir, remote_dir in self.local_dirs(root):
+            try:
+                if self.index.dir_unchanged(local_dir, remote_dir, os.stat(local_dir)):
+                    continue
+            except OSError:
+                pass
+            while remote_dir not in ret:
+                ret.add(remote_dir)
+                if len(remote_dir) <= len(root):
+                    break
+                remote_dir = os.path.dirname(remote_dir)
         return ret
 
+    def record_local_dirs(self, root: str):
+        dirs = []
+        for local_dir, remote_dir in self.local_dirs(scanner.normpath(root)):
+            try:
+                dirs.append((local_dir, remote_dir, os.stat(local_dir)))
+            except OSError:
+                pass
+        self.index.put_dirs(dirs)
+
     def remote_mkdir(self, dst: str):
         api_instance = fileupload_api.FileuploadApi(self.api_client)
         try:
-            api_response = api_instance.xpanfilecreate(
-                self.auth.get_access_token(), dst, 1, 0, None, [])
+            # a directory has no upload session, but the sdk still types
+            # uploadid and block_list as required strings
+            with self.metrics.timer('mkdir'):
+                api_response = api_instance.xpanfilecreate(
+                    self.auth.get_access_token(), dst, 1, 0, '', '[]')
             if api_response.get('errno', -1) != 0:
                 raise SyncException(f"xpanmkdir {dst} error: {api_response}")
         except exceptions.ApiException as e:
@@ -138,38 +422,112 @@ class Sync(object):
         api_instance = fileupload_api.FileuploadApi(self.api_client)
         stat = os.stat(src)
         size = stat.st_size
-        block_list = self.md5_blocks(src)
         logging.info(f'start sync file {src}, size {size}')
         try:
-            block_list_str = '[' + \
-                ','.join('"' + b + '"' for b in block_list) + ']'
-            api_response = api_instance.xpanfileprecreate(
-                token, dst, 0, size, 1, block_list_str, rtype=3)
+            entry = self.journal.load(dst, stat, self.blocksize)
+            if entry is not None:
+                logging.info(
+                    f"resume upload {src} with {len(entry['acked'])}/{len(entry['block_list'])} blocks done")
+                try:
+                    return self.finish_upload(api_instance, token, src, dst, stat, entry)
+                except UploadSessionException as e:
+                    logging.info(f"upload session of {src} is gone, restart: {e}")
+                    self.journal.remove(dst)
+
+            digest = self.hash_file(src, size)
+            block_list = digest.block_list
+            # with the content and slice md5 precreate creates the file right
+            # away when the server already holds the same content
+            rapid = {}
+            if self.rapid_upload and size > hasher.SLICE_SIZE:
+                rapid = {'content_md5': digest.content_md5, 'slice_md5': digest.slice_md5}
+            with self.metrics.timer('precreate'):
+                api_response = api_instance.xpanfileprecreate(
+                    token, dst, 0, size, 1, self.block_list_str(block_list), rtype=3, **rapid)
             if api_response.get('errno', -1) != 0:
                 raise SyncException(
                     f"xpanfileprecreate {src} error: {api_response}")
-            uploadid = api_response.get('uploadid')
-
-            with open(src, 'rb') as f:
-                for i in range(len(block_list)):
-                    block = f.read(self.blocksize)
-                    if not block:
-                        break
-                    api_response = api_instance.pcssuperfile2(token, str(
-                        i), dst, uploadid, "tmpfile", file=NameBytesIO(src, block))
-                    if api_response.get('md5', "") != block_list[i]:
-                        raise SyncException(
-                            f"pcssuperfile2 {src} with wrong md5: {api_response}, expect {block_list[i]}")
-                    logging.info(
-                        f"sync {src} upload block {i}/{len(block_list)} done")
-            api_response = api_instance.xpanfilecreate(
-                token, dst, 0, size, uploadid, block_list_str, rtype=3)
+            if rapid:
+                hit = api_response.get('return_type') == 2
+                self.rapid_stats.record(size, hit)
+                if hit:
+                    logging.info(f"rapid upload {src} hit, {size} bytes not sent")
+                    self.metrics.inc('files_rapid_uploaded')
+                    self.metrics.inc('bytes_rapid_uploaded', size)
+                    info = api_response.get('info') or {}
+                    self.index.put(src, dst, stat, {'fs_id': info.get('fs_id'), 'md5': info.get('md5'),
+                                                    'server_mtime': info.get('mtime')}, block_list)
+                    return
+            entry = self.journal.new_entry(
+                dst, stat, self.blocksize, api_response.get('uploadid'), block_list)
+            # precreate answers with the partseqs the server still needs
+            needed = api_response.get('block_list')
+            if isinstance(needed, list) and needed:
+                needed = set(needed)
+                entry['acked'] = [i for i in range(len(block_list)) if i not in needed]
+            self.journal.save(entry)
+            self.finish_upload(api_instance, token, src, dst, stat, entry)
         except exceptions.ApiException as e:
             raise SyncException(
                 f"upload file {src} raised pcssdk Exception: {e}")
         except Exception as e:
             raise SyncException(f"Exception when upload file {src}: {e}")
 
+    def finish_upload(self, api_instance, token: str, src: str, dst: str, stat: os.stat_result, entry: Dict):
+        block_list = entry['block_list']
+        acked = set(entry['acked'])
+        self.upload_blocks(api_instance, token, src, dst, entry['uploadid'], block_list,
+                           [i for i in range(len(block_list)) if i not in acked], entry)
+        with self.metrics.timer('create'):
+            api_response = api_instance.xpanfilecreate(
+                token, dst, 0, stat.st_size, entry['uploadid'], self.block_list_str(block_list), rtype=3)
+        if api_response.get('errno', -1) != 0:
+            raise UploadSessionException(
+                f"xpanfilecreate {src} error: {api_response}")
+        self.metrics.inc('files_uploaded')
+        self.journal.remove(dst)
+        self.index.put(src, dst, stat, {'fs_id': api_response.get('fs_id'), 'md5': api_response.get('md5'),
+                                        'server_mtime': api_response.get('mtime')}, block_list)
+
+    def block_list_str(self, block_list: List[str]) -> str:
+        return '[' + ','.join('"' + b + '"' for b in block_list) + ']'
+
+    def upload_blocks(self, api_instance, token: str, src: str, dst: str, uploadid: str, block_list: List[str], partseqs, entry: Optional[Dict] = None):
+        # keep at most block_concurrency blocks in flight on the api_client
+        # pool; results are collected oldest first
+        # blocks are streamed from disk by the rest client, so an in-flight
+        # block costs a socket buffer rather than blocksize bytes
+        inflight = collections.deque()
+        size = os.path.getsize(src)
+        for i in partseqs:
+            if i * self.blocksize >= size:
+                break
+            if len(inflight) >= self.block_concurrency:
+                self.wait_block(inflight.popleft(), src, block_list, entry)
+            block = rest.FileSlice(src, i * self.blocksize, self.blocksize)
+            inflight.append((i, len(block), time.perf_counter(), api_instance.pcssuperfile2(token, str(
+                i), dst, uploadid, "tmpfile", file=block, async_req=True)))
+        while inflight:
+            self.wait_block(inflight.popleft(), src, block_list, entry)
+
+    def wait_block(self, pending, src: str, block_list: List[str], entry: Optional[Dict] = None):
+        i, size, start, result = pending
+        api_response = result.get()
+        # time from queueing to the answer, so waiting for a free pool
+        # thread or in-flight slot shows up here
+        self.metrics.observe('phase_seconds', time.perf_counter() - start, phase='block_upload')
+        if 'error_code' in api_response:
+            raise UploadSessionException(
+                f"pcssuperfile2 {src} error: {api_response}")
+        if api_response.get('md5', "") != block_list[i]:
+            raise SyncException(
+                f"pcssuperfile2 {src} with wrong md5: {api_response}, expect {block_list[i]}")
+        self.metrics.inc('bytes_uploaded', size)
+        if entry is not None:
+            self.journal.ack(entry, i)
+        logging.info(
+            f"sync {src} upload block {i}/{len(block_list)} done")
+
     def download_file(self, token: str, fsid: int, dst: str):
         api_instance = multimediafile_api.MultimediafileApi(self.api_client)
         fsidstr = f'[{fsid}]'
@@ -179,38 +537,45 @@ class Sync(object):
             if api_response.get('errno', -1) != 0 or not api_response.get('list', []):
                 raise SyncException(
                     f"xpanmultimediafileget {fsid} error: {api_response}")
-            dlink = api_response.get('list', [])[0].get('dlink')
+            meta = api_response.get('list', [])[0]
+            dlink = meta.get('dlink')
             if not dlink:
                 raise SyncException(
                     f"xpanmultimediafileget {fsid} error: {api_response}")
             logging.info(f"download {fsid} to {dst}")
-            req = requests.get(f'{dlink}&access_token={token}', headers={
-                               "User-Agent": "pan.baidu.com"}, stream=True)
-            req.raise_for_status()
-            tmp = dst + '.tmp'
-            with open(tmp, 'wb') as f:
-                for chunk in req.iter_content(chunk_size=BLOCKSIZE):
-                    if chunk:
-                        f.write(chunk)
+            url = f'{dlink}&access_token={token}'
+            # hidden, so an interrupted download and its ranges sidecar are
+            # never picked up by the upload walk
+            tmp = os.path.join(os.path.dirname(dst), f'.{os.path.basename(dst)}.tmp')
+            size = meta.get('size', 0)
+            if size > self.blocksize:
+                download.SegmentedDownload(url, tmp, size, self.blocksize, workers=self.block_concurrency,
+                                           identity={'fs_id': fsid, 'md5': meta.get('md5', '')},
+                                           timeout=self.download_timeout, observer=self.metrics).run()
+            else:
+                download.with_retries(download.fetch_file, url, tmp, self.download_timeout, observer=self.metrics)
             os.rename(tmp, dst)
-            req.close()
+            return meta
         except exceptions.ApiException as e:
             raise SyncException(
                 f"download_file file {fsid} raised pcssdk Exception: {e}")
         except Exception as e:
-            raise SyncException(f"Exception when download file {fsid}: {e}")
-
-    def md5(self, data: bytes) -> str:
-        m = hashlib.md5()
-        m.update(data)
-        return m.hexdigest()
-
-    def md5_blocks(self, src: str) -> List[str]:
-        with open(src, 'rb') as f:
-            blocks = []
-            while True:
-                block = f.read(self.blocksize)
-                if not block:
-                    break
-                blocks.append(self.md5(block))
-            return blocks
+            raise SyncException(f"Exception when download file {fsid}: {download.describe_error(e)}")
+
+    def hash_file(self, src: str, size: int) -> hasher.FileDigest:
+        # small files are not worth the round trip to the process pool
+        with self.metrics.timer('hash'):
+            pool = self.hash_pool
+            if pool is None or size < HASH_POOL_MIN_SIZE:
+                return hasher.hash_file(src, self.blocksize, use_mmap=False)
+            try:
+                return pool.submit(hasher.hash_file, src, self.blocksize).result()
+            except BrokenProcessPool:
+                # a worker died, most likely of SIGBUS from a file truncated
+                # under its mmap; later files get a fresh pool
+                logging.warning(f"hash pool broke while hashing {src}, restart it")
+                with self.hash_pool_lock:
+                    if self.hash_pool is pool:
+                        pool.shutdown(wait=False)
+                        self.hash_pool = hasher.new_pool(self.concurrency)
+                return hasher.hash_file(src, self.blocksize, use_mmap=False)
@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'third_party', 'pcssdk'))
+from apiauth import apiauth
+from bench import mockpcs
+from config.config import SyncType
+from openapi_client.configuration import Configuration
+from sync import daemon, sync
+
+class SyncDaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.pcs = mockpcs.MockPCS().start()
+        self.pcs.mkdir('/apps/test')
+        self.dir = tempfile.TemporaryDirectory()
+        self.state = tempfile.TemporaryDirectory()
+        auth = apiauth.Auth(endpoint=f'{self.pcs.url}/oauth/2.0', token_file=os.path.join(self.state.name, '.access_token'))
+        auth.refresh_token_file = os.path.join(self.state.name, '.refresh_token')
+        auth.setup_access_token('code')
+        self.sync = sync.Sync(self.dir.name, '/apps/test', auth, SyncType.UPLOAD, excludes=['.*\\.tmp$'],
+                              journal_dir=os.path.join(self.state.name, 'journal'),
+                              index_file=os.path.join(self.state.name, 'index.db'),
+                              configuration=Configuration(host=self.pcs.url))
+        self.write('old.txt')
+
+    def tearDown(self):
+        self.sync.index.close()
+        self.pcs.stop()
+        self.dir.cleanup()
+        self.state.cleanup()
+
+    def write(self, *parts):
+        path = os.path.join(self.dir.name, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(1000))
+
+    def wait_for(self, path, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if path in self.pcs.files:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_uploads_changed_paths_only(self):
+        d = daemon.SyncDaemon(self.sync, debounce=0.1, reconcile_interval=3600, poll_interval=0.2)
+        t = threading.Thread(target=d.run)
+        t.start()
+        try:
+            self.assertTrue(self.wait_for('/apps/test/old.txt'))
+            self.pcs.reset_counts()
+            self.write('a', 'b', 'new.txt')
+            self.write('skip.tmp')
+            self.assertTrue(self.wait_for('/apps/test/a/b/new.txt'))
+            time.sleep(0.3)
+            requests = self.pcs.stats()['requests']
+            # only the new file is precreated, old.txt is not looked at again
+            self.assertEqual(requests['xpan_file_precreate'], 1)
+            self.assertNotIn('/apps/test/skip.tmp', self.pcs.files)
+        finally:
+            d.stop()
+            t.join()
+
+if __name__ == '__main__':
+    unittest.main()
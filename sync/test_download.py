@@ -0,0 +1,103 @@
+import json
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+from bench import mockpcs
+from sync import download, metrics
+
+class SegmentedDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.pcs = mockpcs.MockPCS().start()
+        self.dir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(5 * 1024 + 100)
+        with self.pcs.lock:
+            entry = self.pcs._put('/apps/test/f.bin', len(self.data), '')
+        with open(self.pcs.blob(entry['fs_id']), 'wb') as f:
+            f.write(self.data)
+        self.url = f"{self.pcs.url}/file/{entry['fs_id']}?fid={entry['fs_id']}"
+        self.tmp = os.path.join(self.dir.name, '.f.bin.tmp')
+
+    def tearDown(self):
+        self.pcs.stop()
+        self.dir.cleanup()
+
+    def new_download(self):
+        return download.SegmentedDownload(self.url, self.tmp, len(self.data), 1024, workers=2,
+                                          identity={'fs_id': 1, 'md5': 'x'})
+
+    def test_resume_fetches_only_missing_ranges(self):
+        fetch = download.SegmentedDownload.fetch
+
+        def interrupted(d, i, start, end):
+            if i in (1, 4):
+                raise ValueError('connection lost')
+            return fetch(d, i, start, end)
+
+        with mock.patch.object(download.SegmentedDownload, 'fetch', interrupted):
+            with self.assertRaises(ValueError):
+                self.new_download().run()
+        with open(self.tmp + '.ranges') as f:
+            self.assertEqual(sorted(json.load(f)['done']), [0, 2, 3, 5])
+        self.pcs.reset_counts()
+
+        d = self.new_download()
+        with mock.patch.object(d, 'fetch', wraps=d.fetch) as fetched:
+            d.run()
+        self.assertEqual(sorted(c.args for c in fetched.call_args_list), [(1, 1024, 2047), (4, 4096, 5119)])
+        self.assertEqual(self.pcs.stats()['requests']['file'], 2)
+        self.assertFalse(os.path.exists(self.tmp + '.ranges'))
+        with open(self.tmp, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_changed_identity_starts_over(self):
+        with mock.patch.object(download.SegmentedDownload, 'fetch', side_effect=ValueError('connection lost')):
+            with self.assertRaises(ValueError):
+                self.new_download().run()
+        self.pcs.reset_counts()
+        d = download.SegmentedDownload(self.url, self.tmp, len(self.data), 1024, identity={'fs_id': 1, 'md5': 'y'})
+        d.run()
+        self.assertEqual(self.pcs.stats()['requests']['file'], 6)
+
+class RetryTest(unittest.TestCase):
+    def test_retry_logs_leave_out_the_access_token(self):
+        with mockpcs.MockPCS(throttle_rate=1.0) as pcs, tempfile.TemporaryDirectory() as d, \
+                mock.patch.object(download, 'RETRY_BACKOFF', 0.001), mock.patch.object(download, 'RETRIES', 2):
+            with self.assertLogs(level='INFO') as logs, self.assertRaises(download.requests.HTTPError) as e:
+                download.with_retries(download.fetch_file, f'{pcs.url}/file/1?fid=1&access_token=secret',
+                                      os.path.join(d, 'f'))
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('HTTPError 429, retry 1/2', logs.output[0])
+        self.assertNotIn('secret', ''.join(logs.output))
+        self.assertIn('secret', str(e.exception))
+        self.assertEqual(download.describe_error(e.exception), 'HTTPError 429')
+
+    def test_retries_are_reported_to_metrics(self):
+        m = metrics.Metrics()
+        with mockpcs.MockPCS(throttle_rate=1.0) as pcs, tempfile.TemporaryDirectory() as d, \
+                mock.patch.object(download, 'RETRY_BACKOFF', 0.001), mock.patch.object(download, 'RETRIES', 2):
+            with self.assertRaises(download.requests.HTTPError):
+                download.SegmentedDownload(f'{pcs.url}/file/1?fid=1', os.path.join(d, '.f.tmp'), 2048, 1024,
+                                           observer=m).run()
+        summary = m.summary()['counters']
+        self.assertEqual(summary['retries']['dlink'], 4)
+        self.assertEqual(summary['throttled']['dlink'], 4)
+
+    def test_silent_connection_times_out_and_is_retried(self):
+        # accepts connections and never answers, like a dropped NAT mapping
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(8)
+        self.addCleanup(server.close)
+        url = f'http://127.0.0.1:{server.getsockname()[1]}/file/1'
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.object(download, 'RETRY_BACKOFF', 0.001), \
+                mock.patch.object(download, 'RETRIES', 1):
+            d = download.SegmentedDownload(url, os.path.join(tmp_dir, '.f.tmp'), 2048, 1024, workers=1, timeout=(1, 0.1))
+            with mock.patch.object(d, 'fetch', wraps=d.fetch) as fetched:
+                with self.assertRaises(download.requests.Timeout):
+                    d.run()
+        self.assertEqual(fetched.call_count, 4)
+
+if __name__ == '__main__':
+    unittest.main()
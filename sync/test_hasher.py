@@ -0,0 +1,56 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+from sync import hasher
+
+class HasherTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_hash_file(self):
+        data = os.urandom(3 * 1024 * 1024 + 5)
+        path = self.write('a', data)
+        digest = hasher.hash_file(path, 1000 * 1000)
+        self.assertEqual(digest.block_list, hasher.read_md5_blocks(path, 1000 * 1000))
+        self.assertEqual(digest.content_md5, hashlib.md5(data).hexdigest())
+        self.assertEqual(digest.slice_md5, hashlib.md5(data[:hasher.SLICE_SIZE]).hexdigest())
+        self.assertEqual(digest.size, len(data))
+
+    def test_hash_empty_file(self):
+        digest = hasher.hash_file(self.write('empty', b''), 1024)
+        self.assertEqual(digest.block_list, [])
+        self.assertEqual(digest.content_md5, hashlib.md5().hexdigest())
+
+    def test_hash_files(self):
+        paths = [self.write(f'f{i}', os.urandom(1000 + i)) for i in range(3)]
+        digests = hasher.hash_files(paths, 512, workers=2)
+        self.assertEqual([digests[p].block_list for p in paths], [hasher.read_md5_blocks(p, 512) for p in paths])
+
+    def test_buffered_matches_mmap(self):
+        for size, blocksize in [(3 * 1024 * 1024 + 5, 1000 * 1000), (300 * 1024, 1024), (100, 4096)]:
+            path = self.write(f'f{size}', os.urandom(size))
+            a, b = hasher.hash_file(path, blocksize), hasher.hash_file(path, blocksize, use_mmap=False)
+            self.assertEqual((a.size, a.block_list, a.content_md5, a.slice_md5),
+                             (b.size, b.block_list, b.content_md5, b.slice_md5))
+
+    def test_file_shrinking_while_hashed(self):
+        path = self.write('a', os.urandom(1000))
+        stat = os.stat(path)
+        # fstat saw the file before it was truncated
+        with mock.patch.object(hasher.os, 'fstat', return_value=os.stat_result((stat.st_mode, 0, 0, 0, 0, 0, 2000, 0, 0, 0))):
+            with self.assertRaises(hasher.FileChanged):
+                hasher.hash_file(path, 512, use_mmap=False)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from sync import metrics
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram_quantile(self):
+        h = metrics.Histogram((0.1, 1, 10))
+        for v in [0.05] * 50 + [0.5] * 40 + [5] * 9 + [20]:
+            h.observe(v)
+        self.assertEqual(h.quantile(0.5), 0.1)
+        self.assertEqual(h.quantile(0.9), 1)
+        self.assertEqual(h.quantile(0.99), 10)
+        self.assertEqual(h.quantile(1), 20)
+        self.assertEqual(h.count, 100)
+
+    def test_counters_from_threads(self):
+        m = metrics.Metrics()
+        def work():
+            for _ in range(1000):
+                m.inc('bytes_uploaded', 10)
+                m.observe_request('xpan/file.precreate', 200, 0.01)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(m.counter('bytes_uploaded'), 40000)
+        summary = m.summary()
+        self.assertEqual(summary['histograms']['request_seconds']['xpan/file.precreate']['count'], 4000)
+        self.assertNotIn('request_errors', summary['counters'])
+
+    def test_prometheus_and_json(self):
+        m = metrics.Metrics()
+        m.observe_request('pcs/superfile2.upload', 'throttled', 0.2)
+        m.observe_retry('pcs/superfile2.upload', True)
+        m.set('inflight_limit', 8)
+        with m.timer('hash'):
+            pass
+        text = m.prometheus(local='/data')
+        self.assertIn('# TYPE pcs_sync_request_seconds histogram', text)
+        self.assertIn('pcs_sync_request_seconds_bucket{local="/data",endpoint="pcs/superfile2.upload",le="0.25"} 1', text)
+        self.assertIn('pcs_sync_request_seconds_bucket{local="/data",endpoint="pcs/superfile2.upload",le="+Inf"} 1', text)
+        self.assertIn('pcs_sync_throttled_total{local="/data",endpoint="pcs/superfile2.upload"} 1', text)
+        self.assertIn('pcs_sync_request_errors_total{local="/data",endpoint="pcs/superfile2.upload",status="throttled"} 1', text)
+        self.assertIn('pcs_sync_inflight_limit{local="/data"} 8', text)
+        self.assertIn('pcs_sync_phase_seconds_count{local="/data",phase="hash"} 1', text)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics.jsonl')
+            metrics.append_json(path, m.summary())
+            metrics.append_json(path, m.summary())
+            with open(path) as f:
+                runs = [json.loads(line) for line in f]
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(runs[0]['counters']['retries']['pcs/superfile2.upload'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
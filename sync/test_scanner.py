@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+from unittest import mock
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'third_party', 'pcssdk'))
+from sync import scanner
+
+class FakeAuth(object):
+    def get_access_token(self):
+        return 'token'
+
+class ScannerTest(unittest.TestCase):
+    def test_list_dir_paginates(self):
+        files = [{'server_filename': f'f{i}'} for i in range(5)]
+        api = mock.Mock()
+        api.xpanfilelist.side_effect = lambda token, dir, showempty, start, limit: \
+            {'errno': 0, 'list': files[int(start):int(start) + limit]}
+        with mock.patch.object(scanner.fileinfo_api, 'FileinfoApi', return_value=api):
+            ret = scanner.RemoteScanner(None, FakeAuth(), limit=2).list_dir('/apps/test')
+        self.assertEqual(sorted(ret), [f'f{i}' for i in range(5)])
+        self.assertEqual(api.xpanfilelist.call_count, 3)
+
+    def test_list_tree(self):
+        pages = [
+            {'errno': 0, 'has_more': 1, 'cursor': 2, 'list': [
+                {'path': '/r/a', 'isdir': 1}, {'path': '/r/a/x', 'isdir': 0}]},
+            {'errno': 0, 'has_more': 0, 'list': [{'path': '/r/y', 'isdir': 0}]},
+        ]
+        api = mock.Mock()
+        api.xpanfilelistall.side_effect = pages
+        with mock.patch.object(scanner.multimediafile_api, 'MultimediafileApi', return_value=api):
+            tree = scanner.RemoteScanner(None, FakeAuth()).list_tree('/r/')
+        self.assertEqual({k: sorted(v) for k, v in tree.items()}, {'/r': ['a', 'y'], '/r/a': ['x']})
+        self.assertEqual(api.xpanfilelistall.call_args.kwargs['start'], 2)
+
+    def test_changed_dirs(self):
+        prev = {'/r/a': (1, 1, 1, ''), '/r/a/b': (1, 2, 1, ''), '/r/a/b/f': (0, 3, 1, 'm'),
+                '/r/c': (1, 4, 1, ''), '/r/c/g': (0, 5, 1, 'm')}
+        cur = dict(prev)
+        cur['/r/a/b/f'] = (0, 3, 2, 'n')
+        self.assertEqual(scanner.changed_dirs('/r', prev, cur), {'/r', '/r/a', '/r/a/b'})
+        self.assertEqual(scanner.changed_dirs('/r', prev, prev), set())
+        del cur['/r/c/g']
+        self.assertIn('/r/c', scanner.changed_dirs('/r/', prev, cur))
+
+if __name__ == '__main__':
+    unittest.main()
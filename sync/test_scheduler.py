@@ -0,0 +1,30 @@
+import threading
+import time
+import unittest
+from sync import scheduler
+
+class TransferSchedulerTest(unittest.TestCase):
+    def test_runs_all_jobs_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+        done = []
+        with scheduler.TransferScheduler(3) as s:
+            for i in range(3):
+                s.submit(f'job {i}', lambda i: done.append(barrier.wait() or i), i)
+        self.assertEqual(sorted(done), [0, 1, 2])
+        self.assertEqual(s.errors, [])
+
+    def test_failed_job_does_not_abort_others(self):
+        def job(i):
+            if i == 1:
+                raise Exception('boom')
+            time.sleep(0.01)
+        with self.assertLogs(level='INFO') as logs:
+            with scheduler.TransferScheduler(2) as s:
+                for i in range(4):
+                    s.submit(f'job {i}', job, i)
+        self.assertEqual([desc for desc, _ in s.errors], ['job 1'])
+        self.assertEqual(logs.output, ['INFO:root:job 0 success', 'ERROR:root:job 1 failed: boom',
+                                       'INFO:root:job 2 success', 'INFO:root:job 3 success'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,283 @@
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'third_party', 'pcssdk'))
+from apiauth import apiauth
+from bench import mockpcs
+from config.config import SyncType
+from openapi_client.configuration import Configuration
+from sync import hasher, sync
+
+class FakeResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+class FakeUploadApi(object):
+    def __init__(self, fail_at=None, known_md5=()):
+        self.lock = threading.Lock()
+        self.known_md5 = known_md5
+        self.parts = {}
+        self.sent = []
+        self.precreated = 0
+        self.fail_at = fail_at
+
+    def xpanfileprecreate(self, token, path, isdir, size, autoinit, block_list, rtype=None, content_md5=None, slice_md5=None):
+        self.precreated += 1
+        if content_md5 in self.known_md5:
+            return {'errno': 0, 'return_type': 2, 'info': {'fs_id': 1, 'md5': content_md5}}
+        return {'errno': 0, 'return_type': 1, 'uploadid': f'id{self.precreated}', 'block_list': []}
+
+    def xpanfilecreate(self, token, path, isdir, size, uploadid, block_list, rtype=None):
+        return {'errno': 0}
+
+    def pcssuperfile2(self, token, partseq, path, uploadid, type, file=None, async_req=False):
+        if int(partseq) == self.fail_at:
+            raise Exception('connection reset')
+        data = file.read()
+        with self.lock:
+            self.parts[int(partseq)] = data
+            self.sent.append(int(partseq))
+        return FakeResult({'md5': hashlib.md5(data).hexdigest()})
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.state = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.dir.name, 'a.bin')
+        with open(self.src, 'wb') as f:
+            f.write(os.urandom(10 * 1024 + 7))
+        self.sync = sync.Sync(self.dir.name, '/apps/test', apiauth.Auth(), blocksize=1024, block_concurrency=3,
+                              journal_dir=os.path.join(self.state.name, 'journal'),
+                              index_file=os.path.join(self.state.name, 'index.db'))
+        self.sync.auth.get_access_token = lambda: 'token'
+
+    def tearDown(self):
+        self.sync.index.close()
+        self.dir.cleanup()
+        self.state.cleanup()
+
+    def test_upload_blocks(self):
+        api = FakeUploadApi()
+        block_list = hasher.hash_file(self.src, self.sync.blocksize).block_list
+        self.sync.upload_blocks(api, 'token', self.src, '/apps/test/a.bin', 'id', block_list, range(len(block_list)))
+        with open(self.src, 'rb') as f:
+            self.assertEqual(b''.join(api.parts[i] for i in sorted(api.parts)), f.read())
+
+    def test_upload_blocks_md5_mismatch(self):
+        block_list = hasher.hash_file(self.src, self.sync.blocksize).block_list
+        block_list[5] = '0' * 32
+        with self.assertRaises(sync.SyncException):
+            self.sync.upload_blocks(FakeUploadApi(), 'token', self.src, '/apps/test/a.bin', 'id', block_list, range(len(block_list)))
+
+    def test_upload_file_resumes_from_journal(self):
+        api = FakeUploadApi(fail_at=6)
+        with mock.patch.object(sync.fileupload_api, 'FileuploadApi', return_value=api):
+            with self.assertRaises(sync.SyncException):
+                self.sync.upload_file('token', self.src, '/apps/test/a.bin')
+            stat = os.stat(self.src)
+            acked = set(self.sync.journal.load('/apps/test/a.bin', stat, 1024)['acked'])
+            api.fail_at = None
+            api.sent = []
+            self.sync.upload_file('token', self.src, '/apps/test/a.bin')
+        self.assertEqual(api.precreated, 1)
+        self.assertTrue(acked)
+        self.assertEqual(set(api.sent), set(range(11)) - acked)
+        self.assertFalse(os.listdir(os.path.join(self.state.name, 'journal')))
+
+    def test_sync_up_dir_skips_indexed_files(self):
+        api = FakeUploadApi()
+        with mock.patch.object(sync.fileupload_api, 'FileuploadApi', return_value=api), \
+                mock.patch.object(self.sync, 'remote_ls', return_value={}) as remote_ls:
+            self.sync.sync_up_dir(self.dir.name, '/apps/test')
+            self.assertEqual(remote_ls.call_count, 1)
+            self.assertEqual(api.precreated, 1)
+            self.sync.sync_up_dir(self.dir.name, '/apps/test')
+            self.assertEqual(remote_ls.call_count, 1)
+            self.assertEqual(api.precreated, 1)
+            os.utime(self.src, ns=(0, 1))
+            self.sync.sync_up_dir(self.dir.name, '/apps/test')
+            self.assertEqual(remote_ls.call_count, 2)
+            self.assertEqual(api.precreated, 2)
+
+    def test_upload_file_rapid_upload(self):
+        data = os.urandom(300 * 1024)
+        for name in ['dup.bin', 'new.bin']:
+            with open(os.path.join(self.dir.name, name), 'wb') as f:
+                f.write(data if name == 'dup.bin' else data[::-1])
+        api = FakeUploadApi(known_md5=(hashlib.md5(data).hexdigest(),))
+        with mock.patch.object(sync.fileupload_api, 'FileuploadApi', return_value=api):
+            self.sync.upload_file('token', os.path.join(self.dir.name, 'dup.bin'), '/apps/test/dup.bin')
+            self.assertEqual(api.sent, [])
+            self.sync.upload_file('token', os.path.join(self.dir.name, 'new.bin'), '/apps/test/new.bin')
+            self.assertEqual(len(api.sent), 300)
+        self.assertEqual(str(self.sync.rapid_stats), 'rapid upload hit 1/2 (50.0%), 307200 bytes not sent')
+
+    def test_hash_file_replaces_broken_pool(self):
+        broken = sync.hasher.new_pool(1)
+        with self.assertRaises(sync.BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        self.sync.hash_pool = broken
+        try:
+            with mock.patch.object(sync, 'HASH_POOL_MIN_SIZE', 0):
+                digest = self.sync.hash_file(self.src, os.path.getsize(self.src))
+                self.assertIsNot(self.sync.hash_pool, broken)
+                # the next file is hashed on the new pool
+                self.assertEqual(self.sync.hash_file(self.src, os.path.getsize(self.src)).block_list, digest.block_list)
+            self.assertEqual(digest.block_list, hasher.hash_file(self.src, self.sync.blocksize).block_list)
+        finally:
+            self.sync.hash_pool.shutdown()
+
+    def test_sync_uploads_and_reports_rapid_stats(self):
+        self.sync.type = sync.SyncType.UPLOAD
+        data = os.urandom(300 * 1024)
+        with open(os.path.join(self.dir.name, 'dup.bin'), 'wb') as f:
+            f.write(data)
+        api = FakeUploadApi(known_md5=(hashlib.md5(data).hexdigest(),))
+        with mock.patch.object(sync.fileupload_api, 'FileuploadApi', return_value=api), \
+                mock.patch.object(self.sync, 'remote_ls', return_value={}):
+            self.sync.sync()
+        self.assertEqual(len(api.sent), 11)
+        self.assertEqual(str(self.sync.rapid_stats), 'rapid upload hit 1/1 (100.0%), 307200 bytes not sent')
+
+class MockPCSSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.pcs = mockpcs.MockPCS().start()
+        self.pcs.mkdir('/apps/test')
+        self.dir = tempfile.TemporaryDirectory()
+        self.state = tempfile.TemporaryDirectory()
+        self.auth = apiauth.Auth(endpoint=f'{self.pcs.url}/oauth/2.0',
+                                 token_file=os.path.join(self.state.name, '.access_token'))
+        self.auth.refresh_token_file = os.path.join(self.state.name, '.refresh_token')
+        self.auth.setup_access_token('code')
+
+    def tearDown(self):
+        self.pcs.stop()
+        self.dir.cleanup()
+        self.state.cleanup()
+
+    def new_sync(self, local, type, index_file):
+        configuration = Configuration(host=self.pcs.url)
+        configuration.retry_backoff = 0.01
+        return sync.Sync(local, '/apps/test', self.auth, type, blocksize=4096,
+                         journal_dir=os.path.join(self.state.name, 'journal'),
+                         index_file=os.path.join(self.state.name, index_file),
+                         configuration=configuration)
+
+    def test_upload_then_download(self):
+        up, down = self.upload_then_download()
+        self.assertEqual(self.pcs.stats()['requests']['xpan_multimedia_listall'], 1)
+        self.assertEqual(up.metrics.counter('files_uploaded'), 3)
+        self.assertEqual(up.metrics.counter('bytes_uploaded'), 14196)
+        self.assertEqual(down.metrics.counter('bytes_downloaded'), 14196)
+        summary = up.metrics.summary()
+        self.assertEqual(summary['histograms']['phase_seconds']['block_upload']['count'], 5)
+        self.assertEqual(summary['histograms']['request_seconds']['xpan/file.precreate']['count'], 3)
+
+    def test_download_restores_local_deletes_in_unchanged_dirs(self):
+        self.upload_then_download()
+        dst = os.path.join(self.dir.name, 'dst')
+        for name in ['top.bin', os.path.join('a', 'b', 'deep.bin')]:
+            os.unlink(os.path.join(dst, name))
+        with open(os.path.join(dst, 'a', 'mid.bin'), 'ab') as f:
+            f.write(b'damaged')
+        os.utime(os.path.join(dst, 'a', 'mid.bin'), (0, 0))
+        self.pcs.reset_counts()
+        s = self.new_sync(dst, SyncType.DOWNLOAD, 'down.db')
+        s.sync()
+        s.index.close()
+        src = os.path.join(self.dir.name, 'src')
+        for name in ['top.bin', os.path.join('a', 'mid.bin'), os.path.join('a', 'b', 'deep.bin')]:
+            with open(os.path.join(src, name), 'rb') as a, open(os.path.join(dst, name), 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+        self.assertEqual(s.metrics.counter('files_downloaded'), 3)
+
+    def test_upload_recreates_dirs_deleted_remotely(self):
+        src = os.path.join(self.dir.name, 'src')
+        os.makedirs(os.path.join(src, 'a', 'sub'))
+        for name in ['top.txt', os.path.join('sub', 'old.txt')]:
+            with open(os.path.join(src, 'a', name), 'w') as f:
+                f.write(name)
+        s = self.new_sync(src, SyncType.UPLOAD, 'up.db')
+        s.sync()
+        with self.pcs.lock:
+            for path in [p for p in self.pcs.files if p == '/apps/test/a' or p.startswith('/apps/test/a/')]:
+                del self.pcs.files[path]
+        with open(os.path.join(src, 'a', 'sub', 'new.txt'), 'w') as f:
+            f.write('new')
+        for _ in range(2):
+            s.sync()
+        s.index.close()
+        for path in ['/apps/test/a/top.txt', '/apps/test/a/sub/old.txt', '/apps/test/a/sub/new.txt']:
+            self.assertIn(path, self.pcs.files)
+        self.assertEqual(s.metrics.counter('files_uploaded'), 0)
+
+    def test_download_visits_only_changed_dirs(self):
+        self.upload_then_download()
+        dst = os.path.join(self.dir.name, 'dst')
+
+        def visited():
+            s = self.new_sync(dst, SyncType.DOWNLOAD, 'down.db')
+            with mock.patch.object(s, 'sync_down_dir', wraps=s.sync_down_dir) as walk:
+                s.sync()
+            s.index.close()
+            return sorted(os.path.relpath(c.args[1], dst) for c in walk.call_args_list)
+
+        # the root is always walked, unchanged dirs below it are not
+        self.assertEqual(visited(), ['.'])
+        os.unlink(os.path.join(dst, 'a', 'b', 'deep.bin'))
+        self.assertEqual(visited(), ['.', 'a', os.path.join('a', 'b')])
+        self.assertTrue(os.path.exists(os.path.join(dst, 'a', 'b', 'deep.bin')))
+        self.assertEqual(visited(), ['.'])
+
+    def test_retries_failed_and_throttled_requests(self):
+        self.pcs.error_rate = 0.1
+        self.pcs.throttle_rate = 0.1
+        self.pcs.random.seed(7)
+        with mock.patch.object(sync.download, 'RETRY_BACKOFF', 0.01):
+            self.upload_then_download()
+
+    def test_updownload_pulls_newer_remote_file(self):
+        hosts = [os.path.join(self.dir.name, h) for h in ('a', 'b')]
+        for h, content in zip(hosts, ['old', 'new content']):
+            os.makedirs(h)
+            with open(os.path.join(h, 'f.txt'), 'w') as f:
+                f.write(content)
+        old = time.time() - 3600
+        os.utime(os.path.join(hosts[0], 'f.txt'), (old, old))
+        for h, type in [(hosts[1], SyncType.UPLOAD), (hosts[0], SyncType.UPDOWNLOAD)]:
+            s = self.new_sync(h, type, f'{os.path.basename(h)}.db')
+            s.sync()
+            s.index.close()
+        with open(os.path.join(hosts[0], 'f.txt')) as f:
+            self.assertEqual(f.read(), 'new content')
+
+    def upload_then_download(self):
+        src = os.path.join(self.dir.name, 'src')
+        dst = os.path.join(self.dir.name, 'dst')
+        os.makedirs(os.path.join(src, 'a', 'b'))
+        os.makedirs(dst)
+        files = {'top.bin': 10000, os.path.join('a', 'mid.bin'): 100, os.path.join('a', 'b', 'deep.bin'): 4096}
+        for name, size in files.items():
+            with open(os.path.join(src, name), 'wb') as f:
+                f.write(os.urandom(size))
+        ret = []
+        for local, type, index_file in [(src, SyncType.UPLOAD, 'up.db'), (dst, SyncType.DOWNLOAD, 'down.db')]:
+            s = self.new_sync(local, type, index_file)
+            s.sync()
+            s.index.close()
+            ret.append(s)
+        for name in files:
+            with open(os.path.join(src, name), 'rb') as a, open(os.path.join(dst, name), 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+        return ret
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import re
+import tempfile
+import time
+import unittest
+from sync import watcher
+
+class ChangeQueueTest(unittest.TestCase):
+    def test_coalesce_and_debounce(self):
+        q = watcher.ChangeQueue()
+        q.put('/a')
+        q.put('/a')
+        q.put('/b')
+        self.assertEqual(q.get(0.2, 0.05), (set(), False))
+        start = time.monotonic()
+        self.assertEqual(q.get(0.2, 1), ({'/a', '/b'}, False))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(q.get(0.2, 0), (set(), False))
+
+    def test_overflow(self):
+        q = watcher.ChangeQueue()
+        q.put('/a')
+        q.put_overflow()
+        self.assertEqual(q.get(10, 1), (set(), True))
+        self.assertEqual(q.pending, {})
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = self.dir.name
+        os.makedirs(os.path.join(self.root, 'sub'))
+        os.makedirs(os.path.join(self.root, 'skip'))
+        self.queue = watcher.ChangeQueue()
+        self.excluded = lambda path: re.compile('.*/skip').match(path) is not None
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, *parts):
+        with open(os.path.join(self.root, *parts), 'wb') as f:
+            f.write(b'data')
+
+    def drain(self, wait=2.0):
+        paths = set()
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            got, _ = self.queue.get(0.05, 0.1)
+            paths |= got
+        return {os.path.relpath(p, self.root) for p in paths}
+
+    def check(self, w):
+        w.start()
+        try:
+            self.write('sub', 'a.txt')
+            self.write('.hidden')
+            self.write('skip', 'b.txt')
+            os.makedirs(os.path.join(self.root, 'new', 'deeper'))
+            self.write('new', 'deeper', 'c.txt')
+            paths = self.drain()
+            self.assertIn(os.path.join('sub', 'a.txt'), paths)
+            self.assertIn(os.path.join('new', 'deeper', 'c.txt'), paths)
+            self.assertNotIn('.hidden', paths)
+            self.assertNotIn(os.path.join('skip', 'b.txt'), paths)
+        finally:
+            w.stop()
+
+    def test_inotify(self):
+        try:
+            w = watcher.InotifyWatcher(self.root, self.queue, self.excluded)
+        except watcher.WatchException as e:
+            self.skipTest(str(e))
+        self.check(w)
+
+    def test_polling(self):
+        self.check(watcher.PollingWatcher(self.root, self.queue, self.excluded, interval=0.2))
+
+if __name__ == '__main__':
+    unittest.main()
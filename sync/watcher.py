@@ -0,0 +1,253 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, Set, Tuple
+
+# inotify event bits, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+# a file is picked up once it is closed after writing or moved in, not on
+# every write, so a file being written is not uploaded half way
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+EVENT = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+POLL_INTERVAL = 5.0
+
+
+class WatchException(Exception):
+    pass
+
+
+class ChangeQueue(object):
+    """Changed paths waiting to be synced, coalesced by path.
+
+    A path is handed out once no new event has arrived for it for
+    `debounce` seconds. An overflow means events were lost and the caller
+    should fall back to a full pass.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending: Dict[str, float] = {}
+        self.overflow = False
+
+    def put(self, path: str):
+        with self.cond:
+            self.pending[path] = time.monotonic()
+            self.cond.notify()
+
+    def put_overflow(self):
+        with self.cond:
+            self.overflow = True
+            self.cond.notify()
+
+    def get(self, debounce: float, timeout: float) -> Tuple[Set[str], bool]:
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.overflow:
+                    self.overflow = False
+                    self.pending.clear()
+                    return set(), True
+                quiet = {p for p, t in self.pending.items() if now - t >= debounce}
+                if quiet:
+                    for p in quiet:
+                        del self.pending[p]
+                    return quiet, False
+                if now >= deadline:
+                    return set(), False
+                wait = deadline - now
+                if self.pending:
+                    wait = min(wait, min(self.pending.values()) + debounce - now)
+                self.cond.wait(wait)
+
+
+def skipped(path: str, root: str, excluded: Callable[[str], bool]) -> bool:
+    # the same entries Sync.sync_up_dir leaves alone
+    return path != root and (os.path.basename(path).startswith('.') or excluded(path))
+
+
+class InotifyWatcher(object):
+    """Watches a tree with one inotify watch per directory.
+
+    A dir moved within the tree keeps reporting under its old path, which
+    no longer exists; the daemon's periodic full pass picks up its changes.
+    """
+
+    def __init__(self, root: str, queue: ChangeQueue, excluded: Callable[[str], bool] = lambda path: False):
+        if not sys.platform.startswith('linux'):
+            raise WatchException('inotify is only available on linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.root = os.path.normpath(root)
+        self.queue = queue
+        self.excluded = excluded
+        self.fd = -1
+        self.wds: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise WatchException(f'inotify_init1 failed: {os.strerror(ctypes.get_errno())}')
+        if not self.add_tree(self.root, False):
+            os.close(self.fd)
+            raise WatchException(f'cannot watch {self.root}')
+        self._thread = threading.Thread(target=self._loop, name='inotify', daemon=True)
+        self._thread.start()
+        logging.info(f"watching {self.root} with inotify, {len(self.wds)} dirs")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_tree(self, path: str, report: bool) -> bool:
+        # a dir that appeared after the watch was set up may already hold
+        # files whose events were missed, so with report its files are queued
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err != errno.ENOENT:
+                logging.error(f"inotify_add_watch {path} failed: {os.strerror(err)}")
+                # without a watch changes below path go unnoticed until the
+                # next full pass, so ask for one
+                self.queue.put_overflow()
+            return False
+        self.wds[wd] = path
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return True
+        for entry in entries:
+            if skipped(entry.path, self.root, self.excluded):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                self.add_tree(entry.path, report)
+            elif report:
+                self.queue.put(entry.path)
+        return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                continue
+            self.handle(data)
+
+    def handle(self, data: bytes):
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                logging.info(f"inotify queue of {self.root} overflowed")
+                self.queue.put_overflow()
+                continue
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            parent = self.wds.get(wd)
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, os.fsdecode(name))
+            if skipped(path, self.root, self.excluded):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path, True)
+                    self.queue.put(path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_ATTRIB):
+                self.queue.put(path)
+
+
+class PollingWatcher(object):
+    """Fallback that compares stat snapshots of the tree every interval."""
+
+    def __init__(self, root: str, queue: ChangeQueue, excluded: Callable[[str], bool] = lambda path: False,
+                 interval: float = POLL_INTERVAL):
+        self.root = os.path.normpath(root)
+        self.queue = queue
+        self.excluded = excluded
+        self.interval = interval
+        self.snapshot: Dict[str, Tuple[int, int, int]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.snapshot = self.scan()
+        self._thread = threading.Thread(target=self._loop, name='poll-watcher', daemon=True)
+        self._thread.start()
+        logging.info(f"watching {self.root} by polling every {self.interval}s")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def scan(self) -> Dict[str, Tuple[int, int, int]]:
+        ret = {}
+        dirs = [self.root]
+        while dirs:
+            try:
+                entries = list(os.scandir(dirs.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if skipped(entry.path, self.root, self.excluded):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        ret[entry.path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                except OSError:
+                    continue
+        return ret
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            snapshot = self.scan()
+            for path, stat in snapshot.items():
+                if self.snapshot.get(path) != stat:
+                    self.queue.put(path)
+            self.snapshot = snapshot
+
+
+def new_watcher(root: str, queue: ChangeQueue, excluded: Callable[[str], bool] = lambda path: False,
+                poll_interval: float = POLL_INTERVAL):
+    try:
+        watcher = InotifyWatcher(root, queue, excluded)
+        watcher.start()
+        return watcher
+    except (WatchException, OSError, AttributeError) as e:
+        logging.info(f"inotify unavailable for {root}, fall back to polling: {e}")
+    watcher = PollingWatcher(root, queue, excluded, poll_interval)
+    watcher.start()
+    return watcher
@@ -235,6 +235,8 @@ class FileuploadApi(object):
                     'autoinit',
                     'block_list',
                     'rtype',
+                    'content_md5',
+                    'slice_md5',
                 ],
                 'required': [
                     'access_token',
@@ -271,6 +273,10 @@ class FileuploadApi(object):
                         (str,),
                     'rtype':
                         (int,),
+                    'content_md5':
+                        (str,),
+                    'slice_md5':
+                        (str,),
                 },
                 'attribute_map': {
                     'access_token': 'access_token',
@@ -280,6 +286,8 @@ class FileuploadApi(object):
                     'autoinit': 'autoinit',
                     'block_list': 'block_list',
                     'rtype': 'rtype',
+                    'content_md5': 'content-md5',
+                    'slice_md5': 'slice-md5',
                 },
                 'location_map': {
                     'access_token': 'query',
@@ -289,6 +297,8 @@ class FileuploadApi(object):
                     'autoinit': 'form',
                     'block_list': 'form',
                     'rtype': 'form',
+                    'content_md5': 'form',
+                    'slice_md5': 'form',
                 },
                 'collection_format_map': {
                 }
@@ -527,6 +537,8 @@ class FileuploadApi(object):
 
         Keyword Args:
             rtype (int): rtype. [optional]
+            content_md5 (str): 文件md5，与slice_md5一起用于秒传. [optional]
+            slice_md5 (str): 文件校验段（前256KB）的md5. [optional]
             _return_http_data_only (bool): response data without head status
                 code and headers. Default is True.
             _preload_content (bool): if False, the urllib3.HTTPResponse object
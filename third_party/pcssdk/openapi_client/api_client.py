@@ -16,10 +16,15 @@ from multiprocessing.pool import ThreadPool
 import io
 import os
 import re
+import threading
 import typing
 from urllib.parse import quote
 from urllib3.fields import RequestField
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from openapi_client import rest
 from openapi_client.configuration import Configuration
@@ -60,16 +65,22 @@ class ApiClient(object):
         to the API
     :param pool_threads: The number of threads to use for async requests
         to the API. More threads means more concurrent API requests.
+    :param fast_deserialize: if True, json responses are parsed straight
+        into plain python objects (with orjson when it is installed) and
+        the model_utils type validation is skipped. Can be overridden per
+        request with `_fast_deserialize`.
     """
 
     _pool = None
+    _pool_lock = threading.Lock()
 
     def __init__(self, configuration=None, header_name=None, header_value=None,
-                 cookie=None, pool_threads=1):
+                 cookie=None, pool_threads=1, fast_deserialize=False):
         if configuration is None:
             configuration = Configuration.get_default_copy()
         self.configuration = configuration
         self.pool_threads = pool_threads
+        self.fast_deserialize = fast_deserialize
 
         self.rest_client = rest.RESTClientObject(configuration)
         self.default_headers = {}
@@ -98,9 +109,11 @@ class ApiClient(object):
         """Create thread pool on first request
          avoids instantiating unused threadpool for blocking clients.
         """
-        if self._pool is None:
-            atexit.register(self.close)
-            self._pool = ThreadPool(self.pool_threads)
+        # several sync workers may issue their first async_req at once
+        with self._pool_lock:
+            if self._pool is None:
+                atexit.register(self.close)
+                self._pool = ThreadPool(self.pool_threads)
         return self._pool
 
     @property
@@ -133,7 +146,8 @@ class ApiClient(object):
         _request_timeout: typing.Optional[typing.Union[int, float, typing.Tuple]] = None,
         _host: typing.Optional[str] = None,
         _check_type: typing.Optional[bool] = None,
-        _content_type: typing.Optional[str] = None
+        _content_type: typing.Optional[str] = None,
+        _fast_deserialize: typing.Optional[bool] = None
     ):
 
         config = self.configuration
@@ -210,8 +224,13 @@ class ApiClient(object):
         if not _preload_content:
             return return_data
 
+        if _fast_deserialize is None:
+            _fast_deserialize = self.fast_deserialize
+
         # deserialize response data
-        if response_type:
+        if response_type and response_type != (file_type,) and _fast_deserialize:
+            return_data = self.deserialize_raw(response_data)
+        elif response_type:
             if response_type != (file_type,):
                 encoding = "utf-8"
                 content_type = response_data.getheader('content-type')
@@ -332,6 +351,20 @@ class ApiClient(object):
         )
         return deserialized_data
 
+    def deserialize_raw(self, response):
+        """Parses a json response into plain python objects without the
+        type validation and conversion done by deserialize.
+
+        :param response: RESTResponse object to be deserialized.
+        :return: the parsed json, or the decoded body if it is not json.
+        """
+        try:
+            if orjson is not None:
+                return orjson.loads(response.data)
+            return json.loads(response.data)
+        except ValueError:
+            return response.data.decode('utf-8', errors='replace')
+
     def call_api(
         self,
         resource_path: str,
@@ -350,7 +383,8 @@ class ApiClient(object):
         _preload_content: bool = True,
         _request_timeout: typing.Optional[typing.Union[int, float, typing.Tuple]] = None,
         _host: typing.Optional[str] = None,
-        _check_type: typing.Optional[bool] = None
+        _check_type: typing.Optional[bool] = None,
+        _fast_deserialize: typing.Optional[bool] = None
     ):
         """Makes the HTTP request (synchronous) and returns deserialized data.
 
@@ -398,6 +432,9 @@ class ApiClient(object):
         :param _check_type: boolean describing if the data back from the server
             should have its type checked.
         :type _check_type: bool, optional
+        :param _fast_deserialize: parse the json response into plain python
+            objects without type validation. Defaults to the client setting.
+        :type _fast_deserialize: bool, optional
         :return:
             If async_req parameter is True,
             the request will be called asynchronously.
@@ -412,7 +449,7 @@ class ApiClient(object):
                                    response_type, auth_settings,
                                    _return_http_data_only, collection_formats,
                                    _preload_content, _request_timeout, _host,
-                                   _check_type)
+                                   _check_type, None, _fast_deserialize)
 
         return self.pool.apply_async(self.__call_api, (resource_path,
                                                        method, path_params,
@@ -425,7 +462,9 @@ class ApiClient(object):
                                                        collection_formats,
                                                        _preload_content,
                                                        _request_timeout,
-                                                       _host, _check_type))
+                                                       _host, _check_type,
+                                                       None,
+                                                       _fast_deserialize))
 
     def request(self, method, url, query_params=None, headers=None,
                 post_params=None, body=None, _preload_content=True,
@@ -549,7 +588,11 @@ class ApiClient(object):
                         "for %s must be open." % param_name
                     )
                 filename = os.path.basename(file_instance.name)
-                filedata = self.get_file_data_and_close_file(file_instance)
+                if isinstance(file_instance, rest.FileSlice):
+                    # streamed by the rest client straight from the file
+                    filedata = file_instance
+                else:
+                    filedata = self.get_file_data_and_close_file(file_instance)
                 mimetype = (mimetypes.guess_type(filename)[0] or
                             'application/octet-stream')
                 params.append(
@@ -674,9 +717,10 @@ class Endpoint(object):
             '_check_input_type',
             '_check_return_type',
             '_content_type',
-            '_spec_property_naming'
+            '_spec_property_naming',
+            '_fast_deserialize'
         ])
-        self.params_map['nullable'].extend(['_request_timeout'])
+        self.params_map['nullable'].extend(['_request_timeout', '_fast_deserialize'])
         self.validations = root_map['validations']
         self.allowed_values = root_map['allowed_values']
         self.openapi_types = root_map['openapi_types']
@@ -689,7 +733,8 @@ class Endpoint(object):
             '_check_input_type': (bool,),
             '_check_return_type': (bool,),
             '_spec_property_naming': (bool,),
-            '_content_type': (none_type, str)
+            '_content_type': (none_type, str),
+            '_fast_deserialize': (none_type, bool)
         }
         self.openapi_types.update(extra_types)
         self.attribute_map = root_map['attribute_map']
@@ -861,4 +906,5 @@ class Endpoint(object):
             _preload_content=kwargs['_preload_content'],
             _request_timeout=kwargs['_request_timeout'],
             _host=_host,
-            collection_formats=params['collection_format'])
+            collection_formats=params['collection_format'],
+            _fast_deserialize=kwargs.get('_fast_deserialize'))
@@ -191,6 +191,29 @@ class Configuration(object):
         self.retries = None
         """Adding retries to override urllib3 default value 3
         """
+        self.request_retries = 5
+        """Times a request is retried after a 5xx, a 429, a connection error
+           or a throttling errno in the response body. 0 disables retries.
+        """
+        self.retry_backoff = 0.5
+        """Base of the exponential backoff between retries, in seconds. The
+           actual wait is drawn uniformly below the capped exponential.
+        """
+        self.retry_backoff_max = 30.0
+        """Upper bound of a single backoff wait, in seconds.
+        """
+        self.rate_limit = 0
+        """Requests per second let through by the token bucket, shared by
+           all threads of an ApiClient. 0 disables rate limiting.
+        """
+        self.rate_burst = 10
+        """Requests the token bucket lets through at once after idling.
+        """
+        self.adaptive_concurrency = True
+        """Limit requests in flight AIMD-style: halve the limit when the
+           server throttles, grow it by one per window of successes, up to
+           connection_pool_maxsize.
+        """
         # Enable client side validation
         self.client_side_validation = True
 
@@ -12,12 +12,17 @@
 import io
 import json
 import logging
+import os
+import random
 import re
 import ssl
+import threading
+import time
 from urllib.parse import urlencode
 from urllib.parse import urlparse
 from urllib.request import proxy_bypass_environment
 import urllib3
+import urllib3.filepost
 import ipaddress
 
 from openapi_client.exceptions import ApiException, UnauthorizedException, ForbiddenException
@@ -50,6 +55,259 @@ class RESTResponse(io.IOBase):
         return self.urllib3_response.getheader(name, default)
 
 
+class FileSlice(io.RawIOBase):
+    """
+    A read-only window of `length` bytes starting at `offset` of a file path
+    or of a buffer (bytes, memoryview, mmap). Passed as a multipart file it
+    is streamed into the request body instead of being read into memory.
+    The underlying file is opened on demand and released once the window
+    has been read, so the slice can be rewound and sent again.
+    """
+
+    def __init__(self, source, offset=0, length=None, name=None):
+        super().__init__()
+        self.source = source
+        self.offset = offset
+        if isinstance(source, str):
+            total = os.path.getsize(source)
+            self.name = name or source
+        else:
+            source = memoryview(source)
+            total = source.nbytes
+            self.name = name or 'block'
+        if length is None:
+            length = total - offset
+        self.length = max(0, min(length, total - offset))
+        self._buffer = None if isinstance(self.source, str) else source.cast('B')[offset:offset + self.length]
+        self._file = None
+        self._pos = 0
+
+    def __len__(self):
+        return self.length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self._pos = max(0, min(pos, self.length))
+        if self._file is not None:
+            self._file.seek(self.offset + self._pos)
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self.length - self._pos)
+        if n <= 0:
+            self.release()
+            return 0
+        if self._buffer is not None:
+            b[:n] = self._buffer[self._pos:self._pos + n]
+        else:
+            if self._file is None:
+                self._file = open(self.source, 'rb', buffering=0)
+                self._file.seek(self.offset + self._pos)
+            n = self._file.readinto(memoryview(b)[:n])
+        self._pos += n
+        return n
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self.release()
+        super().close()
+
+
+class MultipartStream(io.RawIOBase):
+    """
+    A multipart/form-data body assembled from encoded field headers and
+    FileSlice payloads, read sequentially with a fixed-size buffer.
+    """
+
+    def __init__(self, fields, boundary=None):
+        super().__init__()
+        self.boundary = boundary or urllib3.filepost.choose_boundary()
+        self.parts = []
+        for field in urllib3.filepost.iter_field_objects(fields):
+            head = '--%s\r\n%s' % (self.boundary, field.render_headers())
+            self.parts.append(head.encode('utf-8'))
+            data = field.data
+            if isinstance(data, FileSlice):
+                # a slice left at its end by an earlier attempt
+                data.seek(0)
+            if isinstance(data, int):
+                data = str(data)
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            self.parts.append(data)
+            self.parts.append(b'\r\n')
+        self.parts.append(('--%s--\r\n' % self.boundary).encode('latin-1'))
+        self.length = sum(len(p) for p in self.parts)
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        self._part = 0
+        self._pos = 0
+
+    def __len__(self):
+        return self.length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return sum(len(p) for p in self.parts[:self._part]) + self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        # only rewinding to the start is needed by urllib3 retries
+        if pos != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('MultipartStream can only be rewound')
+        for part in self.parts:
+            if isinstance(part, FileSlice):
+                part.seek(0)
+        self._part = 0
+        self._pos = 0
+        return 0
+
+    def readinto(self, b):
+        while self._part < len(self.parts):
+            part = self.parts[self._part]
+            if isinstance(part, FileSlice):
+                n = part.readinto(b)
+            else:
+                n = min(len(b), len(part) - self._pos)
+                b[:n] = part[self._pos:self._pos + n]
+            self._pos += n
+            if n > 0:
+                return n
+            self._part += 1
+            self._pos = 0
+        return 0
+
+    def close(self):
+        for part in self.parts:
+            if isinstance(part, FileSlice):
+                part.release()
+        super().close()
+
+
+def has_file_slice(post_params):
+    for param in post_params:
+        if isinstance(param, tuple) and isinstance(param[1], tuple) \
+                and len(param[1]) > 1 and isinstance(param[1][1], FileSlice):
+            return True
+    return False
+
+
+# errnos pcs answers with, in a 200 response, when an app calls too often
+THROTTLE_ERRNOS = (31034,)
+# statuses that mean the server is overloaded rather than broken
+THROTTLE_STATUSES = (429, 503)
+# the in-flight limit is halved at most once per this many seconds, as the
+# requests in flight when the server pushed back all report it together
+THROTTLE_COOLDOWN = 1.0
+
+
+def is_throttled(r):
+    """Whether a successful response carries a throttling errno."""
+    data = r.data
+    if not data or len(data) > 4096 or not any(str(e).encode() in data for e in THROTTLE_ERRNOS):
+        return False
+    try:
+        body = json.loads(data)
+    except ValueError:
+        return False
+    return isinstance(body, dict) and (
+        body.get('errno') in THROTTLE_ERRNOS or body.get('error_code') in THROTTLE_ERRNOS)
+
+
+def endpoint_of(url):
+    """Short name of the api a url calls, e.g. xpan/file.precreate."""
+    parsed = urlparse(url)
+    name = parsed.path.replace('/rest/2.0/', '', 1).strip('/')
+    method = re.search(r'(?:^|&)method=([^&]+)', parsed.query)
+    return f'{name}.{method.group(1)}' if method else name
+
+
+def retry_after(headers):
+    try:
+        return max(0.0, float(headers.get('Retry-After')))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    """
+    Lets `rate` requests per second through, `burst` at once after idling.
+    A caller that finds the bucket empty reserves the next token and sleeps
+    until it is due, so waiting callers are served in order.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AdaptiveLimiter(object):
+    """
+    Bounds the requests in flight with an AIMD limit: a throttled request
+    halves it, every success adds 1/limit, so the limit grows by one per
+    window of successful requests, up to `max_limit`.
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = float(self.max_limit)
+        self.inflight = 0
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.inflight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self.last_decrease >= THROTTLE_COOLDOWN:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.last_decrease = now
+                    logger.info("throttled, in-flight limit lowered to %d", int(self.limit))
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
 class RESTClientObject(object):
     """
     class RESTClientObject
@@ -74,6 +332,10 @@ class RESTClientObject(object):
 
         if configuration.retries is not None:
             addition_pool_args['retries'] = configuration.retries
+        elif configuration.request_retries > 0:
+            # request() retries itself, urllib3's default Retry(3) would
+            # multiply the attempts under it
+            addition_pool_args['retries'] = False
 
         if configuration.socket_options is not None:
             addition_pool_args['socket_options'] = configuration.socket_options
@@ -108,9 +370,82 @@ class RESTClientObject(object):
                 **addition_pool_args
             )
 
+        self.retries = configuration.request_retries
+        self.retry_backoff = configuration.retry_backoff
+        self.retry_backoff_max = configuration.retry_backoff_max
+        self.rate_limiter = None
+        if configuration.rate_limit:
+            self.rate_limiter = TokenBucket(configuration.rate_limit, configuration.rate_burst)
+        self.limiter = None
+        if configuration.adaptive_concurrency:
+            self.limiter = AdaptiveLimiter(maxsize)
+        # optional, gets observe_request(endpoint, status, seconds) for
+        # every attempt and observe_retry(endpoint, throttled) for every retry
+        self.observer = None
+
+    def backoff(self, attempt):
+        # full jitter: spreads out the clients that were throttled together
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
+
     def request(self, method, url, query_params=None, headers=None,
                 body=None, post_params=None, _preload_content=True,
                 _request_timeout=None):
+        """Perform requests, retrying throttled and transient failures.
+
+        Takes the same arguments as `send`. A request is retried with
+        exponential backoff after a 5xx or 429, a connection error, or a
+        response whose errno says the app is calling too often; once the
+        retries are used up the last error is raised, or the last throttled
+        response returned, as without retries.
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            if self.limiter is not None:
+                self.limiter.acquire()
+            throttled = False
+            wait = None
+            status = None
+            start = time.perf_counter()
+            try:
+                r = self.send(method, url, query_params=query_params, headers=dict(headers or {}),
+                              body=body, post_params=post_params, _preload_content=_preload_content,
+                              _request_timeout=_request_timeout)
+                throttled = _preload_content and is_throttled(r)
+                status = 'throttled' if throttled else r.status
+                if not throttled or attempt >= self.retries:
+                    return r
+                reason = 'throttled'
+            except ApiException as e:
+                status = e.status
+                throttled = e.status in THROTTLE_STATUSES
+                if attempt >= self.retries or not (throttled or (e.status or 0) >= 500):
+                    raise
+                reason = f'status {e.status}'
+                wait = retry_after(e.headers)
+            except urllib3.exceptions.HTTPError as e:
+                status = type(e).__name__
+                if attempt >= self.retries:
+                    raise
+                reason = status
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release(throttled)
+                if self.observer is not None:
+                    self.observer.observe_request(endpoint_of(url), status, time.perf_counter() - start)
+            attempt += 1
+            if self.observer is not None:
+                self.observer.observe_retry(endpoint_of(url), throttled)
+            if wait is None:
+                wait = self.backoff(attempt)
+            logger.info("%s %s %s, retry %d/%d in %.2fs", method, url.split('?')[0], reason,
+                        attempt, self.retries, wait)
+            time.sleep(wait)
+
+    def send(self, method, url, query_params=None, headers=None,
+             body=None, post_params=None, _preload_content=True,
+             _request_timeout=None):
         """Perform requests.
 
         :param method: http request method
@@ -182,13 +517,27 @@ class RESTClientObject(object):
                     # Content-Type which generated by urllib3 will be
                     # overwritten.
                     del headers['Content-Type']
-                    r = self.pool_manager.request(
-                        method, url,
-                        fields=post_params,
-                        encode_multipart=True,
-                        preload_content=_preload_content,
-                        timeout=timeout,
-                        headers=headers)
+                    if has_file_slice(post_params):
+                        stream = MultipartStream(post_params)
+                        headers['Content-Type'] = stream.content_type
+                        headers['Content-Length'] = str(len(stream))
+                        try:
+                            r = self.pool_manager.request(
+                                method, url,
+                                body=stream,
+                                preload_content=_preload_content,
+                                timeout=timeout,
+                                headers=headers)
+                        finally:
+                            stream.close()
+                    else:
+                        r = self.pool_manager.request(
+                            method, url,
+                            fields=post_params,
+                            encode_multipart=True,
+                            preload_content=_preload_content,
+                            timeout=timeout,
+                            headers=headers)
                 # Pass a `string` parameter directly in the body to support
                 # other content types than Json when `body` argument is
                 # provided in serialized form
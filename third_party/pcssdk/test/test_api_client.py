@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+from openapi_client import api_client
+from openapi_client.api import fileinfo_api
+
+LISTING = json.dumps({'errno': 0, 'guid_info': '', 'request_id': 1, 'guid': 0, 'list': [
+    {'fs_id': 1, 'path': '/apps/test/a.bin', 'server_filename': 'a.bin', 'size': 10, 'server_mtime': 1650000000,
+     'isdir': 0, 'category': 6, 'md5': '0' * 32}]}).encode()
+
+
+class FakeResponse(object):
+    def __init__(self, data: bytes):
+        self.data = data
+        self.status = 200
+
+    def getheader(self, name, default=None):
+        return 'application/json; charset=UTF-8' if name.lower() == 'content-type' else default
+
+    def getheaders(self):
+        return {'Content-Type': 'application/json; charset=UTF-8'}
+
+
+class DeserializeRawTest(unittest.TestCase):
+    def list_dir(self, client, **kwargs):
+        """Returns which of the two deserializers handled an xpanfilelist call."""
+        client.request = lambda *args, **kw: FakeResponse(LISTING)
+        with mock.patch.object(client, 'deserialize', wraps=client.deserialize) as slow, \
+                mock.patch.object(client, 'deserialize_raw', wraps=client.deserialize_raw) as fast:
+            ret = fileinfo_api.FileinfoApi(client).xpanfilelist('token', dir='/apps/test', **kwargs)
+        self.assertEqual(ret['list'][0]['fs_id'], 1)
+        self.assertEqual(slow.call_count + fast.call_count, 1)
+        return 'fast' if fast.called else 'slow'
+
+    def test_client_default(self):
+        self.assertEqual(self.list_dir(api_client.ApiClient()), 'slow')
+        self.assertEqual(self.list_dir(api_client.ApiClient(fast_deserialize=True)), 'fast')
+
+    def test_per_call_override(self):
+        self.assertEqual(self.list_dir(api_client.ApiClient(fast_deserialize=True), _fast_deserialize=False), 'slow')
+        self.assertEqual(self.list_dir(api_client.ApiClient(), _fast_deserialize=True), 'fast')
+
+    def test_non_json_body(self):
+        client = api_client.ApiClient(fast_deserialize=True)
+        self.assertEqual(client.deserialize_raw(FakeResponse(b'<html>bad gateway</html>')), '<html>bad gateway</html>')
+        self.assertEqual(client.deserialize_raw(FakeResponse(b'\xff\xfe')), '\ufffd\ufffd')
+
+    def test_json_without_orjson(self):
+        client = api_client.ApiClient(fast_deserialize=True)
+        expected = json.loads(LISTING)
+        with mock.patch.object(api_client, 'orjson', None), \
+                mock.patch.object(api_client.json, 'loads', wraps=json.loads) as loads:
+            self.assertEqual(client.deserialize_raw(FakeResponse(LISTING)), expected)
+        loads.assert_called_once_with(LISTING)
+
+    def test_prefers_orjson(self):
+        client = api_client.ApiClient(fast_deserialize=True)
+        fake = mock.Mock()
+        fake.loads.return_value = {'errno': 0}
+        with mock.patch.object(api_client, 'orjson', fake):
+            self.assertEqual(client.deserialize_raw(FakeResponse(LISTING)), {'errno': 0})
+        fake.loads.assert_called_once_with(LISTING)
+
+
+if __name__ == '__main__':
+    unittest.main()
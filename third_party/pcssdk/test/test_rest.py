@@ -0,0 +1,250 @@
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+import urllib3
+import urllib3.filepost
+from openapi_client import exceptions, rest
+from openapi_client.configuration import Configuration
+
+
+class FileSliceTest(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(10000)
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.write(self.data)
+        f.close()
+        self.path = f.name
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_reads_window_of_path(self):
+        s = rest.FileSlice(self.path, 1000, 3000)
+        self.assertEqual(len(s), 3000)
+        self.assertEqual(s.read(), self.data[1000:4000])
+        s.seek(0)
+        self.assertEqual(s.read(100), self.data[1000:1100])
+        s.close()
+
+    def test_clamps_window_to_end_of_source(self):
+        s = rest.FileSlice(self.path, 9000, 3000)
+        self.assertEqual(len(s), 1000)
+        self.assertEqual(s.read(), self.data[9000:])
+
+    def test_reads_window_of_bytes_and_memoryview(self):
+        for source in [self.data, memoryview(self.data)]:
+            s = rest.FileSlice(source, 1000, 3000)
+            self.assertEqual(s.read(), self.data[1000:4000])
+            s.seek(0)
+            self.assertEqual(s.read(), self.data[1000:4000])
+
+    def test_reads_window_of_mmap(self):
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            s = rest.FileSlice(m, 1000, 3000)
+            self.assertEqual(s.read(), self.data[1000:4000])
+            s.seek(0)
+            self.assertEqual(s.read(), self.data[1000:4000])
+            # the slice holds a view of the mmap, which can't be closed under it
+            del s
+
+
+class MultipartStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(100000)
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.write(self.data)
+        f.close()
+        self.path = f.name
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def fields(self, data):
+        return [('partseq', '3'), ('uploadid', 'id1'), ('file', ('block', data, 'application/octet-stream'))]
+
+    def test_matches_encode_multipart_formdata(self):
+        expected, content_type = urllib3.filepost.encode_multipart_formdata(
+            self.fields(self.data[4096:70000]), boundary='b0undary')
+        for source in [self.path, self.data, memoryview(self.data)]:
+            stream = rest.MultipartStream(self.fields(rest.FileSlice(source, 4096, 70000 - 4096)), boundary='b0undary')
+            self.assertEqual(len(stream), len(expected))
+            self.assertEqual(stream.content_type, content_type)
+            self.assertEqual(stream.read(), expected)
+            stream.close()
+
+    def test_rewind_and_read_again(self):
+        expected, _ = urllib3.filepost.encode_multipart_formdata(self.fields(self.data), boundary='b0undary')
+        stream = rest.MultipartStream(self.fields(rest.FileSlice(self.path)), boundary='b0undary')
+        # raw reads may come back short, part by part
+        head = b''
+        while len(head) < 5000:
+            head += stream.read(5000)
+        self.assertEqual(head, expected[:len(head)])
+        self.assertEqual(stream.tell(), len(head))
+        self.assertEqual(stream.seek(0), 0)
+        self.assertEqual(stream.tell(), 0)
+        self.assertEqual(stream.read(), expected)
+        self.assertEqual(stream.tell(), len(expected))
+        with self.assertRaises(OSError):
+            stream.seek(10)
+
+    def test_rewinds_slice_left_at_its_end(self):
+        block = rest.FileSlice(self.path, 0, 1000)
+        block.read()
+        expected, _ = urllib3.filepost.encode_multipart_formdata(self.fields(self.data[:1000]), boundary='b0undary')
+        self.assertEqual(rest.MultipartStream(self.fields(block), boundary='b0undary').read(), expected)
+
+
+
+def response(status=200, data=b'{"errno": 0}', headers=None):
+    return urllib3.HTTPResponse(body=data, status=status, headers=headers or {}, preload_content=True)
+
+
+THROTTLED = b'{"errno": 31034, "request_id": 1}'
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+class ThrottleTest(unittest.TestCase):
+    def test_is_throttled(self):
+        for data, throttled in [(THROTTLED, True), (b'{"error_code": 31034}', True), (b'{"errno": 0}', False),
+                                (b'{"errno": 0, "size": 31034}', False), (b'31034 not json', False),
+                                (b'[31034]', False), (b'', False)]:
+            self.assertEqual(rest.is_throttled(response(data=data)), throttled, data)
+
+    def test_token_bucket_paces_after_burst(self):
+        clock = Clock()
+        with mock.patch.object(rest.time, 'monotonic', clock.monotonic), \
+                mock.patch.object(rest.time, 'sleep', clock.sleep):
+            bucket = rest.TokenBucket(10, burst=2)
+            for _ in range(4):
+                bucket.acquire()
+            # waiting callers reserve tokens in turn
+            self.assertEqual([round(s, 6) for s in clock.sleeps], [0.1, 0.2])
+            clock.now += 10
+            bucket.acquire()
+            bucket.acquire()
+            self.assertEqual(len(clock.sleeps), 2)
+            bucket.acquire()
+            self.assertEqual(round(clock.sleeps[-1], 6), 0.1)
+
+    def test_adaptive_limiter_halves_once_per_cooldown_and_grows_back(self):
+        clock = Clock()
+        with mock.patch.object(rest.time, 'monotonic', clock.monotonic):
+            limiter = rest.AdaptiveLimiter(8)
+
+            def release(throttled):
+                limiter.acquire()
+                limiter.release(throttled)
+
+            release(True)
+            self.assertEqual(limiter.limit, 4)
+            release(True)
+            self.assertEqual(limiter.limit, 4)
+            clock.now += rest.THROTTLE_COOLDOWN
+            release(True)
+            self.assertEqual(limiter.limit, 2)
+            for _ in range(3):
+                clock.now += rest.THROTTLE_COOLDOWN
+                release(True)
+            self.assertEqual(limiter.limit, 1)
+            # +1/limit per success, about one step up per window of successes
+            release(False)
+            self.assertEqual(limiter.limit, 2)
+            release(False)
+            self.assertEqual(limiter.limit, 2.5)
+            for _ in range(100):
+                release(False)
+            self.assertEqual(limiter.limit, 8)
+            self.assertEqual(limiter.inflight, 0)
+
+    def test_adaptive_limiter_blocks_at_limit(self):
+        limiter = rest.AdaptiveLimiter(1)
+        limiter.acquire()
+        acquired = threading.Event()
+        t = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+        t.start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release()
+        self.assertTrue(acquired.wait(5))
+        t.join()
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        configuration = Configuration(host='http://pcs.invalid')
+        configuration.request_retries = 2
+        self.client = rest.RESTClientObject(configuration)
+        self.clock = Clock()
+        patcher = mock.patch.object(rest.time, 'sleep', self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, *responses):
+        with mock.patch.object(self.client.pool_manager, 'request', side_effect=list(responses)) as sent:
+            try:
+                return self.client.request('GET', 'http://pcs.invalid/rest/2.0/xpan/file?method=list')
+            finally:
+                self.calls = sent.call_count
+
+    def test_retries_5xx_then_succeeds(self):
+        r = self.request(response(500), response(502), response(200))
+        self.assertEqual(r.status, 200)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(len(self.clock.sleeps), 2)
+
+    def test_raises_last_error_when_retries_run_out(self):
+        with self.assertRaises(exceptions.ServiceException):
+            self.request(response(500), response(500), response(503))
+        self.assertEqual(self.calls, 3)
+
+    def test_returns_last_throttled_response_when_retries_run_out(self):
+        r = self.request(*[response(data=THROTTLED) for _ in range(3)])
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(r.data, THROTTLED)
+        self.assertEqual(self.client.limiter.inflight, 0)
+
+    def test_no_retry_on_4xx(self):
+        with self.assertRaises(exceptions.NotFoundException):
+            self.request(response(404), response(200))
+        self.assertEqual(self.calls, 1)
+        with self.assertRaises(exceptions.ApiException):
+            self.request(response(400), response(200))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_honours_retry_after(self):
+        r = self.request(response(429, headers={'Retry-After': '7'}), response(200))
+        self.assertEqual(r.status, 200)
+        self.assertEqual(self.clock.sleeps, [7.0])
+
+    def test_urllib3_retries_disabled_under_retry_loop(self):
+        self.assertIs(self.client.pool_manager.connection_pool_kw['retries'].total, False)
+        configuration = Configuration(host='http://pcs.invalid')
+        configuration.request_retries = 0
+        self.assertNotIn('retries', rest.RESTClientObject(configuration).pool_manager.connection_pool_kw)
+
+    def test_retries_connection_errors(self):
+        r = self.request(urllib3.exceptions.ProtocolError('connection reset'), response(200))
+        self.assertEqual(r.status, 200)
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()